@@ -3,6 +3,7 @@ import functools
 import torch.nn as nn
 import torch
 import numpy as np
+from torch.utils.checkpoint import checkpoint
 from modules import SharedMLP, PVConv, PointNetSAModule, PointNetAModule, PointNetFPModule, Attention, Swish
 
 
@@ -170,6 +171,8 @@ def create_pointnet2_fp_modules(fp_blocks, in_channels, sa_in_channels, embed_di
 
 
 class PVCNN2Base(nn.Module):
+    # recompute each SA/FP block's activations in backward instead of storing them (training only)
+    activation_checkpoint = False
 
     def __init__(self, num_classes, embed_dim, use_att, dropout=0.1,
                  extra_feature_channels=3, width_multiplier=1, voxel_resolution_multiplier=1):
@@ -222,6 +225,11 @@ class PVCNN2Base(nn.Module):
         assert emb.shape == torch.Size([timesteps.shape[0], self.embed_dim])
         return emb
 
+    def _run_block(self, block, *args):
+        if self.activation_checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint(lambda *a: block(a), *args, use_reentrant=False)
+        return block(args)
+
     def forward(self, inputs, t):
 
         temb =  self.embedf(self.get_timestep_embedding(t, inputs.device))[:,:,None].expand(-1,-1,inputs.shape[-1])
@@ -233,14 +241,14 @@ class PVCNN2Base(nn.Module):
             in_features_list.append(features)
             coords_list.append(coords)
             if i == 0:
-                features, coords, temb = sa_blocks ((features, coords, temb))
+                features, coords, temb = self._run_block(sa_blocks, features, coords, temb)
             else:
-                features, coords, temb = sa_blocks ((torch.cat([features,temb],dim=1), coords, temb))
+                features, coords, temb = self._run_block(sa_blocks, torch.cat([features,temb],dim=1), coords, temb)
         in_features_list[0] = inputs[:, 3:, :].contiguous()
         if self.global_att is not None:
             features = self.global_att(features)
         for fp_idx, fp_blocks  in enumerate(self.fp_layers):
-            features, coords, temb = fp_blocks((coords_list[-1-fp_idx], coords, torch.cat([features,temb],dim=1), in_features_list[-1-fp_idx], temb))
+            features, coords, temb = self._run_block(fp_blocks, coords_list[-1-fp_idx], coords, torch.cat([features,temb],dim=1), in_features_list[-1-fp_idx], temb)
 
         return self.classifier(features)
 
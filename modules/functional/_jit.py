@@ -0,0 +1,88 @@
+import glob
+import hashlib
+import importlib.util
+import os
+
+import torch
+from torch.utils.cpp_extension import load
+
+__all__ = ['load_op', 'OPS']
+
+_src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+_build_root = os.environ.get('PVCNN_JIT_CACHE', os.path.expanduser('~/.cache/pvcnn'))
+
+# extension name -> source sub-directory, mirrors the extensions built by setup.py
+OPS = {
+    '_pvcnn_ball_query': 'ball_query',
+    '_pvcnn_grouping': 'grouping',
+    '_pvcnn_interpolate': 'interpolate',
+    '_pvcnn_sampling': 'sampling',
+    '_pvcnn_voxelization': 'voxelization',
+}
+
+_release_defines = ['-DNDEBUG', '-UTORCH_USE_CUDA_DSA']
+_cflags = ['-O3', '-std=c++17'] + _release_defines
+_cuda_cflags = ['-O3', '-std=c++17'] + _release_defines
+# fast math only for the distance-heavy sources (relative to src/), as in setup.py
+_fast_math_sources = {'ball_query/ball_query_cuda.cu', 'interpolate/neighbor_interpolate_cuda.cu'}
+_fast_math = ['--use_fast_math', '--ftz=true', '--prec-div=false', '--prec-sqrt=false']
+
+
+def _sources(op_dir):
+    src_dir = os.path.join(_src_path, op_dir)
+    return sorted(glob.glob(os.path.join(src_dir, '*.cpp')) + glob.glob(os.path.join(src_dir, '*.cu')))
+
+
+def _is_fast_math(path):
+    return os.path.relpath(path, _src_path) in _fast_math_sources
+
+
+def _digest(op_dir):
+    """
+    Stable key over everything that affects the compiled module
+    :param op_dir: source sub-directory of the op
+    :return: hex digest of sources, headers, flags, torch/CUDA version and SM
+    """
+    h = hashlib.sha256()
+    files = glob.glob(os.path.join(_src_path, op_dir, '*')) + glob.glob(os.path.join(_src_path, '*.*'))
+    for path in sorted(files):
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    h.update(' '.join(_cflags + _cuda_cflags + _fast_math + sorted(_fast_math_sources)).encode())
+    h.update(f'{torch.__version__}|{torch.version.cuda}'.encode())
+    if torch.cuda.is_available():
+        h.update('{}.{}'.format(*torch.cuda.get_device_capability()).encode())
+    return h.hexdigest()
+
+
+def load_op(name):
+    """
+    JIT-compile a single op extension, or import it straight from the cache
+    :param name: extension name, one of OPS
+    :return: the extension module
+    """
+    op_dir = OPS[name]
+    module_name = f'{name}_{_digest(op_dir)[:16]}'
+    build_dir = os.path.join(_build_root, module_name)
+    library = os.path.join(build_dir, f'{module_name}.so')
+    if os.path.exists(library):
+        # a build for exactly these sources and flags exists, skip the ninja round-trip
+        spec = importlib.util.spec_from_file_location(module_name, library)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    os.makedirs(build_dir, exist_ok=True)
+    sources = _sources(op_dir)
+    fast = [s for s in sources if _is_fast_math(s)]
+    extra_ldflags = []
+    if fast:
+        # load() takes one set of nvcc flags, so the fast-math sources become a
+        # small shared library of their own that the extension links against
+        load(name=f'{module_name}_fast_math', sources=fast,
+             extra_cflags=_cflags, extra_cuda_cflags=_cuda_cflags + _fast_math,
+             build_directory=build_dir, with_cuda=True, is_python_module=False, verbose=False)
+        extra_ldflags.append(os.path.join(build_dir, f'{module_name}_fast_math.so'))
+    return load(name=module_name, sources=[s for s in sources if s not in fast],
+                extra_cflags=_cflags, extra_cuda_cflags=_cuda_cflags, extra_ldflags=extra_ldflags,
+                build_directory=build_dir, with_cuda=True, verbose=False)
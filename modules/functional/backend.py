@@ -1,5 +1,27 @@
 import os
+from types import SimpleNamespace
 
-import _pvcnn_backend as _backend
+# load each op's kernels on first launch instead of all of them at context creation;
+# must be set before CUDA is initialised to take effect
+os.environ.setdefault('CUDA_MODULE_LOADING', 'LAZY')
+
+import torch  # noqa: E402, F401 -- loads libtorch before the extensions that link against it
 
 __all__ = ['_backend']
+
+if os.environ.get('PVCNN_JIT', '0') == '1':
+    # development mode: compile each op on first import, cached under ~/.cache/pvcnn
+    from modules.functional._jit import OPS, load_op
+    _exts = [load_op(name) for name in OPS]
+else:
+    import _pvcnn_ball_query
+    import _pvcnn_grouping
+    import _pvcnn_interpolate
+    import _pvcnn_sampling
+    import _pvcnn_voxelization
+    _exts = [_pvcnn_ball_query, _pvcnn_grouping, _pvcnn_interpolate, _pvcnn_sampling, _pvcnn_voxelization]
+
+# each op is built as its own extension; expose them behind a single namespace
+_backend = SimpleNamespace()
+for _ext in _exts:
+    _backend.__dict__.update({k: v for k, v in vars(_ext).items() if not k.startswith('_')})
@@ -1,4 +1,6 @@
+import torch
 from torch.autograd import Function
+from torch.cuda.amp import custom_bwd, custom_fwd
 
 from modules.functional.backend import _backend
 
@@ -7,6 +9,7 @@ __all__ = ['trilinear_devoxelize']
 
 class TrilinearDevoxelization(Function):
     @staticmethod
+    @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, features, coords, resolution, is_training=True):
         """
         :param ctx:
@@ -27,6 +30,7 @@ class TrilinearDevoxelization(Function):
         return outs
 
     @staticmethod
+    @custom_bwd
     def backward(ctx, grad_output):
         """
         :param ctx: 
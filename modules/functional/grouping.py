@@ -1,4 +1,6 @@
+import torch
 from torch.autograd import Function
+from torch.cuda.amp import custom_bwd, custom_fwd
 
 from modules.functional.backend import _backend
 
@@ -7,6 +9,7 @@ __all__ = ['grouping']
 
 class Grouping(Function):
     @staticmethod
+    @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, features, indices):
         """
         :param ctx:
@@ -22,6 +25,7 @@ class Grouping(Function):
         return _backend.grouping_forward(features, indices)
 
     @staticmethod
+    @custom_bwd
     def backward(ctx, grad_output):
         indices, = ctx.saved_tensors
         grad_features = _backend.grouping_backward(grad_output.contiguous(), indices, ctx.num_points)
@@ -1,4 +1,6 @@
+import torch
 from torch.autograd import Function
+from torch.cuda.amp import custom_bwd, custom_fwd
 
 from modules.functional.backend import _backend
 
@@ -7,6 +9,7 @@ __all__ = ['nearest_neighbor_interpolate']
 
 class NeighborInterpolation(Function):
     @staticmethod
+    @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, points_coords, centers_coords, centers_features):
         """
         :param ctx:
@@ -27,6 +30,7 @@ class NeighborInterpolation(Function):
         return points_features
 
     @staticmethod
+    @custom_bwd
     def backward(ctx, grad_output):
         indices, weights = ctx.saved_tensors
         grad_centers_features = _backend.three_nearest_neighbors_interpolate_backward(
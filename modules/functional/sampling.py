@@ -1,6 +1,7 @@
 import numpy as np
 import torch
 from torch.autograd import Function
+from torch.cuda.amp import custom_bwd, custom_fwd
 
 from modules.functional.backend import _backend
 
@@ -9,6 +10,7 @@ __all__ = ['gather', 'furthest_point_sample', 'logits_mask']
 
 class Gather(Function):
     @staticmethod
+    @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, features, indices):
         """
         Gather
@@ -25,6 +27,7 @@ class Gather(Function):
         return _backend.gather_features_forward(features, indices)
 
     @staticmethod
+    @custom_bwd
     def backward(ctx, grad_output):
         indices, = ctx.saved_tensors
         grad_features = _backend.gather_features_backward(grad_output.contiguous(), indices, ctx.num_points)
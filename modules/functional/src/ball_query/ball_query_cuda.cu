@@ -16,10 +16,11 @@
     points_coords : coordinates of points, FloatTensor[b, 3, n]
     neighbors_indices : neighbor indices in points, IntTensor[b, m, u]
 */
-__global__ void ball_query_kernel(int b, int n, int m, float r2, int u,
-                                  const float *__restrict__ centers_coords,
-                                  const float *__restrict__ points_coords,
-                                  int *__restrict__ neighbors_indices) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    ball_query_kernel(int b, int n, int m, float r2, int u,
+                      const float *__restrict__ centers_coords,
+                      const float *__restrict__ points_coords,
+                      int *__restrict__ neighbors_indices) {
   int batch_index = blockIdx.x;
   int index = threadIdx.x;
   int stride = blockDim.x;
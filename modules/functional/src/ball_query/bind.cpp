@@ -0,0 +1,7 @@
+#include <pybind11/pybind11.h>
+
+#include "ball_query.hpp"
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("ball_query", &ball_query_forward, "Ball Query (CUDA)");
+}
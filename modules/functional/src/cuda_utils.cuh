@@ -12,6 +12,14 @@
 
 #define MAXIMUM_THREADS 512
 
+// Minimum resident blocks per SM promised to ptxas. This sets the register
+// budget of every kernel: 65536 / (MAXIMUM_THREADS * PVCNN_MIN_BLOCKS) per
+// thread, 64 by default. -maxrregcount is ignored for kernels with launch bounds.
+#ifndef PVCNN_MIN_BLOCKS
+#define PVCNN_MIN_BLOCKS 2
+#endif
+#define PVCNN_LAUNCH_BOUNDS __launch_bounds__(MAXIMUM_THREADS, PVCNN_MIN_BLOCKS)
+
 inline int optimal_num_threads(int work_size) {
   const int pow_2 = std::log2(static_cast<double>(work_size));
   return max(min(1 << pow_2, MAXIMUM_THREADS), 1);
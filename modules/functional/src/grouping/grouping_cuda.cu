@@ -15,10 +15,11 @@
     indices : neighbor indices in points, IntTensor[b, m, u]
     out     : gathered features, FloatTensor[b, c, m, u]
 */
-__global__ void grouping_kernel(int b, int c, int n, int m, int u,
-                                const float *__restrict__ features,
-                                const int *__restrict__ indices,
-                                float *__restrict__ out) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    grouping_kernel(int b, int c, int n, int m, int u,
+                    const float *__restrict__ features,
+                    const int *__restrict__ indices,
+                    float *__restrict__ out) {
   int batch_index = blockIdx.x;
   features += batch_index * n * c;
   indices += batch_index * m * u;
@@ -55,10 +56,11 @@ void grouping(int b, int c, int n, int m, int u, const float *features,
     indices : neighbor indices in points, IntTensor[b, m, u]
     grad_x: grad of points' features, FloatTensor[b, c, n]
 */
-__global__ void grouping_grad_kernel(int b, int c, int n, int m, int u,
-                                     const float *__restrict__ grad_y,
-                                     const int *__restrict__ indices,
-                                     float *__restrict__ grad_x) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    grouping_grad_kernel(int b, int c, int n, int m, int u,
+                         const float *__restrict__ grad_y,
+                         const int *__restrict__ indices,
+                         float *__restrict__ grad_x) {
   int batch_index = blockIdx.x;
   grad_y += batch_index * m * u * c;
   indices += batch_index * m * u;
@@ -17,10 +17,11 @@
     indices       : indices of nearest 3 centers to the point,
                     IntTensor[b, 3, n]
 */
-__global__ void three_nearest_neighbors_kernel(
-    int b, int n, int m, const float *__restrict__ points_coords,
-    const float *__restrict__ centers_coords, float *__restrict__ weights,
-    int *__restrict__ indices) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    three_nearest_neighbors_kernel(
+        int b, int n, int m, const float *__restrict__ points_coords,
+        const float *__restrict__ centers_coords, float *__restrict__ weights,
+        int *__restrict__ indices) {
   int batch_index = blockIdx.x;
   int index = threadIdx.x;
   int stride = blockDim.x;
@@ -87,10 +88,11 @@ __global__ void three_nearest_neighbors_kernel(
     weights         : weights for interpolation, FloatTensor[b, 3, n]
     out             : features of points, FloatTensor[b, c, n]
 */
-__global__ void three_nearest_neighbors_interpolate_kernel(
-    int b, int c, int m, int n, const float *__restrict__ centers_features,
-    const int *__restrict__ indices, const float *__restrict__ weights,
-    float *__restrict__ out) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    three_nearest_neighbors_interpolate_kernel(
+        int b, int c, int m, int n, const float *__restrict__ centers_features,
+        const int *__restrict__ indices, const float *__restrict__ weights,
+        float *__restrict__ out) {
   int batch_index = blockIdx.x;
   centers_features += batch_index * m * c;
   indices += batch_index * n * 3;
@@ -142,10 +144,11 @@ void three_nearest_neighbors_interpolate(int b, int c, int m, int n,
     weights : weights for interpolation, FloatTensor[b, 3, n]
     grad_x  : grad of features of centers, FloatTensor[b, c, m]
 */
-__global__ void three_nearest_neighbors_interpolate_grad_kernel(
-    int b, int c, int n, int m, const float *__restrict__ grad_y,
-    const int *__restrict__ indices, const float *__restrict__ weights,
-    float *__restrict__ grad_x) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    three_nearest_neighbors_interpolate_grad_kernel(
+        int b, int c, int n, int m, const float *__restrict__ grad_y,
+        const int *__restrict__ indices, const float *__restrict__ weights,
+        float *__restrict__ grad_x) {
   int batch_index = blockIdx.x;
   grad_y += batch_index * n * c;
   indices += batch_index * n * 3;
@@ -18,13 +18,14 @@
     wgts   : weight for trilinear interpolation, FloatTensor[b, 8, n]
     outs   : outputs, FloatTensor[b, c, n]
 */
-__global__ void trilinear_devoxelize_kernel(int b, int c, int n, int r, int r2,
-                                            int r3, bool is_training,
-                                            const float *__restrict__ coords,
-                                            const float *__restrict__ feat,
-                                            int *__restrict__ inds,
-                                            float *__restrict__ wgts,
-                                            float *__restrict__ outs) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    trilinear_devoxelize_kernel(int b, int c, int n, int r, int r2,
+                                int r3, bool is_training,
+                                const float *__restrict__ coords,
+                                const float *__restrict__ feat,
+                                int *__restrict__ inds,
+                                float *__restrict__ wgts,
+                                float *__restrict__ outs) {
   int batch_index = blockIdx.x;
   int stride = blockDim.x;
   int index = threadIdx.x;
@@ -116,10 +117,11 @@ __global__ void trilinear_devoxelize_kernel(int b, int c, int n, int r, int r2,
     grad_y : grad outputs, FloatTensor[b, c, n]
     grad_x : grad inputs, FloatTensor[b, c, r3]
 */
-__global__ void trilinear_devoxelize_grad_kernel(
-    int b, int c, int n, int r3, const int *__restrict__ inds,
-    const float *__restrict__ wgts, const float *__restrict__ grad_y,
-    float *__restrict__ grad_x) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    trilinear_devoxelize_grad_kernel(
+        int b, int c, int n, int r3, const int *__restrict__ inds,
+        const float *__restrict__ wgts, const float *__restrict__ grad_y,
+        float *__restrict__ grad_x) {
   int batch_index = blockIdx.x;
   int stride = blockDim.x;
   int index = threadIdx.x;
@@ -14,10 +14,11 @@
     indices : centers' indices in points, IntTensor[b, m]
     out     : gathered features, FloatTensor[b, c, m]
 */
-__global__ void gather_features_kernel(int b, int c, int n, int m,
-                                       const float *__restrict__ features,
-                                       const int *__restrict__ indices,
-                                       float *__restrict__ out) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    gather_features_kernel(int b, int c, int n, int m,
+                           const float *__restrict__ features,
+                           const int *__restrict__ indices,
+                           float *__restrict__ out) {
   int batch_index = blockIdx.x;
   int channel_index = blockIdx.y;
   int temp_index = batch_index * c + channel_index;
@@ -49,10 +50,11 @@ void gather_features(int b, int c, int n, int m, const float *features,
     indices : centers' indices in points, IntTensor[b, m]
     grad_x  : grad of points' features, FloatTensor[b, c, n]
 */
-__global__ void gather_features_grad_kernel(int b, int c, int n, int m,
-                                            const float *__restrict__ grad_y,
-                                            const int *__restrict__ indices,
-                                            float *__restrict__ grad_x) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    gather_features_grad_kernel(int b, int c, int n, int m,
+                                const float *__restrict__ grad_y,
+                                const int *__restrict__ indices,
+                                float *__restrict__ grad_x) {
   int batch_index = blockIdx.x;
   int channel_index = blockIdx.y;
   int temp_index = batch_index * c + channel_index;
@@ -83,10 +85,11 @@ void gather_features_grad(int b, int c, int n, int m, const float *grad_y,
     distances : minimum distance of a point to the set, IntTensor[b, n]
     indices   : sampled centers' indices in points, IntTensor[b, m]
 */
-__global__ void furthest_point_sampling_kernel(int b, int n, int m,
-                                               const float *__restrict__ coords,
-                                               float *__restrict__ distances,
-                                               int *__restrict__ indices) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    furthest_point_sampling_kernel(int b, int n, int m,
+                                   const float *__restrict__ coords,
+                                   float *__restrict__ distances,
+                                   int *__restrict__ indices) {
   if (m <= 0)
     return;
   int batch_index = blockIdx.x;
@@ -15,9 +15,10 @@
     ind    : voxel index of each point, IntTensor[b, n]
     cnt    : #points in each voxel index, IntTensor[b, s]
 */
-__global__ void grid_stats_kernel(int b, int n, int r, int r2, int r3,
-                                  const int *__restrict__ coords,
-                                  int *__restrict__ ind, int *cnt) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    grid_stats_kernel(int b, int n, int r, int r2, int r3,
+                      const int *__restrict__ coords,
+                      int *__restrict__ ind, int *cnt) {
   int batch_index = blockIdx.x;
   int stride = blockDim.x;
   int index = threadIdx.x;
@@ -45,11 +46,12 @@ __global__ void grid_stats_kernel(int b, int n, int r, int r2, int r3,
     feat: features, FloatTensor[b, c, n]
     out : outputs, FloatTensor[b, c, s]
 */
-__global__ void avg_voxelize_kernel(int b, int c, int n, int s,
-                                    const int *__restrict__ ind,
-                                    const int *__restrict__ cnt,
-                                    const float *__restrict__ feat,
-                                    float *__restrict__ out) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    avg_voxelize_kernel(int b, int c, int n, int s,
+                        const int *__restrict__ ind,
+                        const int *__restrict__ cnt,
+                        const float *__restrict__ feat,
+                        float *__restrict__ out) {
   int batch_index = blockIdx.x;
   int stride = blockDim.x;
   int index = threadIdx.x;
@@ -83,11 +85,12 @@ __global__ void avg_voxelize_kernel(int b, int c, int n, int s,
     grad_y : grad outputs, FloatTensor[b, c, s]
     grad_x : grad inputs, FloatTensor[b, c, n]
 */
-__global__ void avg_voxelize_grad_kernel(int b, int c, int n, int r3,
-                                         const int *__restrict__ ind,
-                                         const int *__restrict__ cnt,
-                                         const float *__restrict__ grad_y,
-                                         float *__restrict__ grad_x) {
+__global__ void PVCNN_LAUNCH_BOUNDS
+    avg_voxelize_grad_kernel(int b, int c, int n, int r3,
+                             const int *__restrict__ ind,
+                             const int *__restrict__ cnt,
+                             const float *__restrict__ grad_y,
+                             float *__restrict__ grad_x) {
   int batch_index = blockIdx.x;
   int stride = blockDim.x;
   int index = threadIdx.x;
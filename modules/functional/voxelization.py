@@ -1,4 +1,6 @@
+import torch
 from torch.autograd import Function
+from torch.cuda.amp import custom_bwd, custom_fwd
 
 from modules.functional.backend import _backend
 
@@ -7,6 +9,7 @@ __all__ = ['avg_voxelize']
 
 class AvgVoxelization(Function):
     @staticmethod
+    @custom_fwd(cast_inputs=torch.float32)
     def forward(ctx, features, coords, resolution):
         """
         :param ctx:
@@ -24,6 +27,7 @@ class AvgVoxelization(Function):
         return out.view(b, c, resolution, resolution, resolution)
 
     @staticmethod
+    @custom_bwd
     def backward(ctx, grad_output):
         """
         :param ctx:
@@ -1,63 +1,410 @@
+import concurrent.futures
+import glob
+import json
 import os
 import shutil
+import subprocess
+import sysconfig
 from setuptools import setup, Command
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+from torch.utils.cpp_extension import BuildExtension, CUDAExtension, CUDA_HOME, include_paths
 import torch
 
 _root = os.path.dirname(os.path.abspath(__file__))
 _src_path = os.path.join(_root, "modules", "functional", "src")
-_torch_lib_dir = os.path.join(os.path.dirname(torch.__file__), "lib")
+_ccache_dir = os.path.join(_root, "build", ".ccache")
+_arch_cache = os.path.join(_root, "build", ".pvcnn_cache.json")
+
+
+def _setup_ccache():
+    """Route host and device compiles through ccache when it is installed.
+
+    nvcc goes through `PYTORCH_NVCC`, which `BuildExtension` honours in its ninja
+    file. The host compiler uses ccache's masquerade mode (symlinks named after
+    the compiler, first on PATH) because `BuildExtension` probes `CXX` as a single
+    executable and rejects "ccache g++".
+    """
+    ccache = shutil.which("ccache")
+    if ccache is None:
+        return None
+    os.environ.setdefault("CCACHE_DIR", _ccache_dir)
+    os.environ.setdefault("CCACHE_COMPILERCHECK", "content")
+    # needed for ccache to cache TUs that use the torch PCH
+    os.environ.setdefault("CCACHE_SLOPPINESS", "pch_defines,time_macros")
+    bin_dir = os.path.join(_ccache_dir, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    for compiler in ["c++", "g++", "gcc"]:
+        link = os.path.join(bin_dir, compiler)
+        if not os.path.lexists(link):
+            os.symlink(ccache, link)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    if CUDA_HOME is not None:
+        os.environ.setdefault("PYTORCH_NVCC", f"{ccache} {os.path.join(CUDA_HOME, 'bin', 'nvcc')}")
+    return ccache
+
+
+_ccache = _setup_ccache()
+# ninja runs one compile per core (BuildExtension otherwise falls back to a
+# conservative default), and each nvcc splits its per-arch work across threads
+os.environ.setdefault("MAX_JOBS", str(max(1, (os.cpu_count() or 2) - 1)))
+os.environ.setdefault("NVCC_THREADS", "4")
+
+
+def _probe_sms():
+    """SMs of the local GPUs, cached in `build/.pvcnn_cache.json`.
+
+    The cache is keyed by the torch and CUDA versions, so repeat builds skip CUDA
+    initialisation and always emit the same `-gencode` list, which keeps ccache warm.
+    """
+    key = {"torch": torch.__version__, "nvcc": torch.version.cuda}
+    try:
+        with open(_arch_cache) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    if cached.get("sm") and all(cached.get(k) == v for k, v in key.items()):
+        return cached["sm"]
+    if not torch.cuda.is_available():
+        return []
+    sms = sorted({"{}.{}".format(*torch.cuda.get_device_capability(i)) for i in range(torch.cuda.device_count())})
+    os.makedirs(os.path.dirname(_arch_cache), exist_ok=True)
+    with open(_arch_cache, "w") as f:
+        json.dump(dict(key, sm=sms), f)
+    return sms
+
+
+# named entries of TORCH_CUDA_ARCH_LIST, as mapped by torch's `_get_cuda_arch_flags`
+_named_arches = {
+    "Kepler+Tesla": "3.7",
+    "Kepler": "3.5+PTX",
+    "Maxwell+Tegra": "5.3",
+    "Maxwell": "5.0;5.2+PTX",
+    "Pascal": "6.0;6.1+PTX",
+    "Volta+Tegra": "7.2",
+    "Volta": "7.0+PTX",
+    "Turing": "7.5+PTX",
+    "Ampere+Tegra": "8.7",
+    "Ampere": "8.0;8.6+PTX",
+    "Ada": "8.9+PTX",
+    "Hopper": "9.0+PTX",
+}
+
+
+def _cuda_arch_flags():
+    """Build SASS-only `-gencode` flags for the target SMs.
+
+    `TORCH_CUDA_ARCH_LIST` (e.g. "8.0;8.6+PTX" or "Ampere") takes precedence, as it
+    does for `BuildExtension`, so release wheels can list several SMs; otherwise the
+    GPUs installed on the build host are used. No `code=compute_XX` (PTX) entry is
+    emitted, so kernels never go through the driver JIT on first launch.
+    """
+    arch_list = os.environ.get("TORCH_CUDA_ARCH_LIST")
+    if arch_list:
+        arch_list = arch_list.replace(" ", ";")
+        for named, sms in _named_arches.items():
+            arch_list = arch_list.replace(named, sms)
+        archs = [a for a in arch_list.split(";") if a]
+    else:
+        archs = _probe_sms()
+    if not archs:
+        print("No GPU found and TORCH_CUDA_ARCH_LIST unset, using torch's default arch list")
+        return []
+    flags = []
+    for arch in archs:
+        cc = arch.split("+")[0]  # "+PTX" suffixes are dropped on purpose
+        if not cc.replace(".", "").isdigit():
+            raise ValueError(f"Unknown CUDA arch ({arch}) in TORCH_CUDA_ARCH_LIST, "
+                             f"expected e.g. 8.6 or one of {', '.join(_named_arches)}")
+        cc = cc.replace(".", "")
+        flag = f"-gencode=arch=compute_{cc},code=sm_{cc}"
+        if cc and flag not in flags:
+            flags.append(flag)
+    return flags
+
+
+def _host_compiler_flags():
+    """Pin nvcc's host compiler only when `PVCNN_CUDA_HOST_COMPILER` is set.
+
+    e.g. PVCNN_CUDA_HOST_COMPILER=/usr/bin/gcc-9 for toolkits that reject newer GCC.
+    """
+    pinned = os.environ.get("PVCNN_CUDA_HOST_COMPILER")
+    compiler = pinned or shutil.which("g++")
+    if compiler is not None:
+        try:
+            banner = subprocess.check_output([compiler, "--version"], text=True).splitlines()[0]
+        except (OSError, subprocess.CalledProcessError, IndexError):
+            banner = "unknown version"
+        print(f"CUDA host compiler: {compiler} ({banner})")
+    return [f"--compiler-bindir={pinned}"] if pinned else []
+
+
+def _gcc_major():
+    """Major version of the host C++ compiler if it is GCC, else None."""
+    compiler = os.environ.get("CXX", "c++")
+    try:
+        version = subprocess.check_output([compiler, "-dumpversion"], text=True).strip()
+        banner = subprocess.check_output([compiler, "--version"], text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if "clang" in banner:
+        return None
+    return int(version.split(".")[0])
+
+
+def _lto_flags():
+    """Host-side LTO flags, empty when the C++ compiler is not GCC >= 9.
+
+    Objects stay fat (regular code next to the LTO IR), so they still link if the
+    LDSHARED driver is a different compiler without GCC's LTO plugin.
+    """
+    major = _gcc_major()
+    if major is None or major < 9:
+        return []
+    return ["-flto=auto" if major >= 10 else "-flto"]
+
+
+_lto = _lto_flags()
+# release defines shared by host and device TUs: device-side assertions are an
+# #ifdef switch, so undefine it, never "=0"
+_release_defines = ["-DNDEBUG", "-UTORCH_USE_CUDA_DSA"]
+_cxx_flags = [
+    "-O3", "-std=c++17", "-ffast-math", "-funroll-loops",
+    "-ffunction-sections", "-fdata-sections",
+    "-fvisibility=hidden", "-fvisibility-inlines-hidden",
+] + _release_defines + _lto
+_nvcc_flags = [
+    "-O3",
+    "-std=c++17",  # same dialect as the cxx TUs; nvcc forwards it to the host compiler
+    "--expt-relaxed-constexpr",
+    "--expt-extended-lambda",
+    "--extra-device-vectorization",
+    # ptxas diagnostics and line info cost nothing at runtime but surface
+    # spills/local memory at build time and give per-line SASS attribution
+    "-Xptxas=-O3,-v,-warn-lmem-usage,-warn-spills,-warn-double-usage",
+    "-lineinfo",
+    f"--threads={os.environ['NVCC_THREADS']}",
+    "-Xcompiler=-ffunction-sections,-fdata-sections",
+    "-Xfatbin=-compress-all",
+    # register budget per thread: -maxrregcount is ignored for kernels with launch bounds,
+    # so PVCNN_MAXREG becomes the min-blocks term of their __launch_bounds__ (cuda_utils.cuh)
+    f"-DPVCNN_MIN_BLOCKS={max(1, 65536 // (512 * int(os.environ.get('PVCNN_MAXREG', '64'))))}",
+] + _release_defines + _host_compiler_flags()
+# the extensions are installed next to the `torch` package, so resolve libtorch
+# relative to the .so rather than baking in the build-time torch location
+_link_flags = [
+    "-Wl,-rpath,$ORIGIN/torch/lib",
+    "-Wl,--disable-new-dtags",
+    "-Wl,-O1",
+    "-Wl,--gc-sections",
+    "-Wl,-s",
+    "-Wl,--build-id=none",
+] + _lto
+
+# one extension per op, so ninja builds them independently and an edit only
+# relinks the op it touches; `modules/functional/backend.py` stitches them together.
+# Each op directory carries its own `bind.cpp`, so editing one op never
+# recompiles another op's bindings. Sources are globbed and sorted so the
+# build command line is stable across runs.
+_op_dirs = ["ball_query", "grouping", "interpolate", "sampling", "voxelization"]
+
+
+def _op_sources(op_dir):
+    src_dir = os.path.join(_src_path, op_dir)
+    return sorted(glob.glob(os.path.join(src_dir, "*.cpp")) + glob.glob(os.path.join(src_dir, "*.cu")))
+
+
+_ops = {f"_pvcnn_{d}": _op_sources(d) for d in _op_dirs}
+
+# fast math only for the kernels dominated by distance math (sqrt, division), per
+# source file: trilinear devoxelization, voxelization's averaging and the gathers
+# keep IEEE semantics. Paths are relative to `modules/functional/src`.
+_fast_math = ["--use_fast_math", "--ftz=true", "--prec-div=false", "--prec-sqrt=false"]
+_fast_math_sources = {"ball_query/ball_query_cuda.cu", "interpolate/neighbor_interpolate_cuda.cu"}
+
+
+def _pybind11_abi_defines():
+    """The pybind11 ABI macros `BuildExtension` adds to every extension TU."""
+    defines = []
+    for name in ["COMPILER_TYPE", "STDLIB", "BUILD_ABI"]:
+        value = getattr(torch._C, f"_PYBIND11_{name}", None)
+        if value is not None:
+            defines.append(f'-DPYBIND11_{name}="{value}"')
+    return defines
+
+
+def _build_torch_pch(name, cflags):
+    """Precompile `torch/extension.h` for one extension and return the flags that
+    force-include it.
+
+    Only the .cpp wrappers use it: nvcc's host pass cannot consume a GCC PCH.
+    The header is built with the same defines `BuildExtension` injects into the
+    extension's TUs (TORCH_EXTENSION_NAME differs per extension, hence one PCH
+    each), so GCC accepts it instead of warning under -Winvalid-pch and silently
+    falling back to the plain header.
+    """
+    pch_dir = os.path.join(_root, "build", "pch", name)
+    header = os.path.join(pch_dir, "torch_extension.h")
+    os.makedirs(pch_dir, exist_ok=True)
+    with open(header, "w") as f:
+        f.write("#include <torch/extension.h>\n")
+    # -g keeps the PCH usable whether or not the TU itself emits debug info
+    cmd = [os.environ.get("CXX", "c++"), "-x", "c++-header", "-g"] + cflags
+    cmd += [
+        "-DTORCH_API_INCLUDE_EXTENSION_H",
+        *_pybind11_abi_defines(),
+        f"-DTORCH_EXTENSION_NAME={name}",
+        f"-D_GLIBCXX_USE_CXX11_ABI={int(torch._C._GLIBCXX_USE_CXX11_ABI)}",
+        f"-I{sysconfig.get_paths()['include']}",
+    ]
+    cmd += [f"-I{p}" for p in include_paths(cuda=True)]
+    cmd += [header, "-o", header + ".gch"]
+    print(f"Precompiling {header}")
+    if subprocess.run(cmd).returncode != 0:
+        print(f"Failed to precompile torch/extension.h for {name}, building it without PCH")
+        return []
+    flags = ["-include", header, "-Winvalid-pch"]
+    if _ccache is not None:
+        flags.append("-fpch-preprocess")
+    return flags
+
+
+class BuildExt(BuildExtension):
+    """`BuildExtension` that resolves the target SMs (cached across builds) and
+    prepares each extension's torch PCH before compiling, adds fast math to the
+    listed CUDA sources only, and strips the produced libraries afterwards."""
+
+    def build_extensions(self):
+        arch_flags = _cuda_arch_flags()
+        pch_flags = self._build_pchs()
+        for ext in self.extensions:
+            ext.extra_compile_args["cxx"] = pch_flags.get(ext.name, []) + ext.extra_compile_args["cxx"]
+            ext.extra_compile_args["nvcc"] = ext.extra_compile_args["nvcc"] + arch_flags
+        # --as-needed only applies to the libraries after it, and extra_link_args come after
+        # the -lc10 -ltorch ... options, so it goes on the linker driver itself
+        self.compiler.linker_so = self.compiler.linker_so + ["-Wl,--as-needed"]
+        super().build_extensions()
+        self._strip()
+
+    def build_extension(self, ext):
+        fast = [s for s in ext.sources if os.path.relpath(s, _src_path) in _fast_math_sources]
+        if not fast:
+            return super().build_extension(ext)
+        # BuildExtension compiles all of an extension's sources with one set of nvcc
+        # flags, so the fast-math sources go through a second compile call
+        compile_ = self.compiler.compile
+
+        def compile_split(sources, extra_postargs=None, **kwargs):
+            rest = [s for s in sources if s not in fast]
+            fast_postargs = dict(extra_postargs, nvcc=extra_postargs["nvcc"] + _fast_math)
+            objects = compile_(rest, extra_postargs=extra_postargs, **kwargs) if rest else []
+            return objects + compile_(fast, extra_postargs=fast_postargs, **kwargs)
+
+        self.compiler.compile = compile_split
+        try:
+            return super().build_extension(ext)
+        finally:
+            self.compiler.compile = compile_
+
+    def _build_pchs(self):
+        if os.environ.get("PVCNN_PCH", "1") == "0" or _gcc_major() is None:
+            return {}
+        # the TUs also get the interpreter's CFLAGS (compiler_so), which have to match too
+        with concurrent.futures.ThreadPoolExecutor(len(self.extensions)) as pool:
+            futures = {ext.name: pool.submit(_build_torch_pch, ext.name,
+                                             self.compiler.compiler_so[1:] + ext.extra_compile_args["cxx"])
+                       for ext in self.extensions}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _strip(self):
+        objcopy = shutil.which("objcopy")
+        if objcopy is None:
+            return
+        for ext in self.extensions:
+            path = self.get_ext_fullpath(ext.name)
+            if not os.path.exists(path):
+                continue
+            before = os.path.getsize(path)
+            subprocess.run([objcopy, "--strip-unneeded", path], check=True)
+            print(f"Stripped {os.path.basename(path)}: {before / 2 ** 20:.2f} -> "
+                  f"{os.path.getsize(path) / 2 ** 20:.2f} MiB")
+
+
+def _tree_size(path):
+    if os.path.isfile(path) or os.path.islink(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, f))
+               for dirpath, _, files in os.walk(path) for f in files
+               if not os.path.islink(os.path.join(dirpath, f)))
+
+
+def _remove(path):
+    """Delete a file or directory and return the number of bytes freed."""
+    size = _tree_size(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+    return size
 
 
 class Clean(Command):
-    """Custom clean command to tidy up the project root."""
-    user_options = []
+    """Custom clean command to tidy up the project root and stale build caches."""
+    user_options = [("with-ccache", None, "also clear the ccache compiler cache")]
+    boolean_options = ["with-ccache"]
 
     def initialize_options(self):
-        pass
+        self.with_ccache = False
 
     def finalize_options(self):
         pass
 
     def run(self):
-        for dir_path in ['build', 'dist', 'pvcnn_backend.egg-info']:
-            if os.path.isdir(dir_path):
-                print(f'Removing directory: {dir_path}')
-                shutil.rmtree(dir_path)
+        if _ccache is not None and os.path.isdir(_ccache_dir):
+            subprocess.run([_ccache, "--show-stats"])
+            if self.with_ccache:
+                subprocess.run([_ccache, "-C"])
+
+        targets = [os.path.join(_root, d) for d in ['dist', 'pvcnn_backend.egg-info']]
+        build_dir = os.path.join(_root, 'build')
+        if os.path.isdir(build_dir):
+            # keep the compiler cache unless asked otherwise, it is what makes the next build fast
+            targets += [os.path.join(build_dir, e) for e in os.listdir(build_dir)
+                        if self.with_ccache or os.path.join(build_dir, e) != _ccache_dir]
+        # objects and `-keep` intermediates left in the source tree, in-place builds of the extensions
+        for pattern in ['*.o', '*.cubin']:
+            targets += glob.glob(os.path.join(_src_path, '**', pattern), recursive=True)
+            targets += glob.glob(os.path.join(_root, pattern))
+        targets += glob.glob(os.path.join(_root, '_pvcnn_*.so'))
+        # torch JIT builds (`~/.cache/torch_extensions/<py_cu>/_pvcnn_*`) and the ops in our own JIT
+        # cache; PVCNN_JIT_CACHE may point at a shared directory, so only our entries go
+        targets += glob.glob(os.path.expanduser('~/.cache/torch_extensions/*/_pvcnn_*'))
+        jit_cache = os.environ.get('PVCNN_JIT_CACHE', os.path.expanduser('~/.cache/pvcnn'))
+        targets += glob.glob(os.path.join(glob.escape(jit_cache), '_pvcnn_*'))
+
+        freed = 0
+        for path in targets:
+            if os.path.lexists(path):
+                print(f'Removing: {path}')
+                freed += _remove(path)
+        print(f'Freed {freed / 2 ** 20:.1f} MiB')
 
 
 setup(
     name="pvcnn_backend",
     ext_modules=[
         CUDAExtension(
-            name="_pvcnn_backend",
-            sources=[
-                os.path.join(_src_path, f)
-                for f in [
-                    "ball_query/ball_query.cpp",
-                    "ball_query/ball_query_cuda.cu",
-                    "grouping/grouping.cpp",
-                    "grouping/grouping_cuda.cu",
-                    "interpolate/neighbor_interpolate.cpp",
-                    "interpolate/neighbor_interpolate_cuda.cu",
-                    "interpolate/trilinear_devox.cpp",
-                    "interpolate/trilinear_devox_cuda.cu",
-                    "sampling/sampling.cpp",
-                    "sampling/sampling_cuda.cu",
-                    "voxelization/vox.cpp",
-                    "voxelization/vox_cuda.cu",
-                    "bindings.cpp",
-                ]
-            ],
+            name=name,
+            sources=sources,
             extra_compile_args={
-                "cxx": ["-O3", "-std=c++17"], # -O0 for debugging, -O3 for production
-                "nvcc": ["--compiler-bindir=/usr/bin/gcc-9"], # ! for gcc-9, change to gcc-10 for gcc-10
+                # copies: BuildExtension appends per-extension defines in place
+                "cxx": list(_cxx_flags),  # -O0 for debugging, -O3 for production
+                "nvcc": list(_nvcc_flags),
             },
-            extra_link_args=[f'-Wl,-rpath,{_torch_lib_dir}'],
+            extra_link_args=list(_link_flags),
         )
+        for name, sources in _ops.items()
     ],
     cmdclass={
-        "build_ext": BuildExtension,
+        "build_ext": BuildExt.with_options(use_ninja=True),
         "clean": Clean,
     },
 )
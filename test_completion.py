@@ -310,10 +310,8 @@ class GaussianDiffusion:
                 new_mse_b = ((pred_xstart - x_start[:, :, self.sv_points:]) ** 2).mean(dim=list(range(1, len(pred_xstart.shape))))
                 assert new_vals_b.shape == new_mse_b.shape ==  torch.Size([B])
                 # Insert the calculated term into the tensor of all terms
-                mask_bt = t_b[:, None]==torch.arange(T, device=t_b.device)[None, :].float()
-                vals_bt_ = vals_bt_ * (~mask_bt) + new_vals_b[:, None] * mask_bt
-                mse_bt_ = mse_bt_ * (~mask_bt) + new_mse_b[:, None] * mask_bt
-                assert mask_bt.shape == vals_bt_.shape == vals_bt_.shape == torch.Size([B, T])
+                vals_bt_[:, t] = new_vals_b
+                mse_bt_[:, t] = new_mse_b
 
             prior_bpd_b = self._prior_bpd(x_start[:,:,self.sv_points:])
             total_bpd_b = vals_bt_.sum(dim=1) + prior_bpd_b
@@ -516,7 +516,9 @@ def main(opt):
         logger.info("Resume Path:%s" % opt.model)
 
         resumed_param = torch.load(opt.model)
-        model.load_state_dict(resumed_param['model_state'])
+        # training saves the denoiser without the DataParallel/DDP 'module.' level; older checkpoints have it
+        model.load_state_dict({k if k.startswith('model.module.') else k.replace('model.', 'model.module.', 1): v
+                               for k, v in resumed_param['model_state'].items()})
 
 
         ref = None
@@ -30,15 +30,16 @@ def rotation_matrix(axis, theta):
                      [2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)],
                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
 
+# fixed viewing rotation used by rotate(), composed once at import
+_ROT = (rotation_matrix([0, 1, 0], np.pi / 2).transpose()
+        @ rotation_matrix([1, 0, 0], -np.pi / 4).transpose()
+        @ rotation_matrix([0, 0, 1], np.pi).transpose())
+
 def rotate(vertices, faces):
     '''
     vertices: [numpoints, 3]
     '''
-    M = rotation_matrix([0, 1, 0], np.pi / 2).transpose()
-    N = rotation_matrix([1, 0, 0], -np.pi / 4).transpose()
-    K = rotation_matrix([0, 0, 1], np.pi).transpose()
-
-    v, f = vertices[:,[1,2,0]].dot(M).dot(N).dot(K), faces[:,[1,2,0]]
+    v, f = vertices[:,[1,2,0]] @ _ROT, faces[:,[1,2,0]]
     return v, f
 
 def norm(v, f):
@@ -359,10 +360,8 @@ class GaussianDiffusion:
                 new_mse_b = ((pred_xstart - x_start[:, :, self.sv_points:]) ** 2).mean(dim=list(range(1, len(pred_xstart.shape))))
                 assert new_vals_b.shape == new_mse_b.shape ==  torch.Size([B])
                 # Insert the calculated term into the tensor of all terms
-                mask_bt = t_b[:, None]==torch.arange(T, device=t_b.device)[None, :].float()
-                vals_bt_ = vals_bt_ * (~mask_bt) + new_vals_b[:, None] * mask_bt
-                mse_bt_ = mse_bt_ * (~mask_bt) + new_mse_b[:, None] * mask_bt
-                assert mask_bt.shape == vals_bt_.shape == vals_bt_.shape == torch.Size([B, T])
+                vals_bt_[:, t] = new_vals_b
+                mse_bt_[:, t] = new_mse_b
 
             prior_bpd_b = self._prior_bpd(x_start[:,:,self.sv_points:])
             total_bpd_b = vals_bt_.sum(dim=1) + prior_bpd_b
@@ -717,25 +716,15 @@ def train(gpu, opt, output_dir, noises_init):
 
 
 
-        if (epoch + 1) % opt.saveIter == 0:
-
-            if should_diag:
-
-
-                save_dict = {
-                    'epoch': epoch,
-                    'model_state': model.state_dict(),
-                    'optimizer_state': optimizer.state_dict()
-                }
-
-                torch.save(save_dict, '%s/epoch_%d.pth' % (output_dir, epoch))
+        if (epoch + 1) % opt.saveIter == 0 and should_diag:
 
+            save_dict = {
+                'epoch': epoch,
+                'model_state': model.state_dict(),
+                'optimizer_state': optimizer.state_dict()
+            }
 
-            if opt.distribution_type == 'multi':
-                dist.barrier()
-                map_location = {'cuda:%d' % 0: 'cuda:%d' % gpu}
-                model.load_state_dict(
-                    torch.load('%s/epoch_%d.pth' % (output_dir, epoch), map_location=map_location)['model_state'])
+            torch.save(save_dict, '%s/epoch_%d.pth' % (output_dir, epoch))
 
     dist.destroy_process_group()
 
@@ -4,9 +4,12 @@ import torch.optim as optim
 import torch.utils.data
 
 import argparse
-from torch.distributions import Normal
+import concurrent.futures
+import contextlib
+import math
 import numpy as np
 import os
+from typing import Optional
 import easydict
 from utils.file_utils import get_output_dir, setup_output_subdirs, copy_source, setup_logging, set_seed
 from utils.render import save_image
@@ -36,15 +39,16 @@ def rotation_matrix(axis, theta):
                      [2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)],
                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
 
+# fixed viewing rotation used by rotate(), composed once at import
+_ROT = (rotation_matrix([0, 1, 0], np.pi / 2).transpose()
+        @ rotation_matrix([1, 0, 0], -np.pi / 4).transpose()
+        @ rotation_matrix([0, 0, 1], np.pi).transpose())
+
 def rotate(vertices, faces):
     '''
     vertices: [numpoints, 3]
     '''
-    M = rotation_matrix([0, 1, 0], np.pi / 2).transpose()
-    N = rotation_matrix([1, 0, 0], -np.pi / 4).transpose()
-    K = rotation_matrix([0, 0, 1], np.pi).transpose()
-
-    v, f = vertices[:,[1,2,0]].dot(M).dot(N).dot(K), faces[:,[1,2,0]]
+    v, f = vertices[:,[1,2,0]] @ _ROT, faces[:,[1,2,0]]
     return v, f
 
 def norm(v, f):
@@ -53,11 +57,43 @@ def norm(v, f):
     return v, f
 
 def getGradNorm(net):
-    pNorm = torch.sqrt(sum(torch.sum(p ** 2) for p in net.parameters()))
-    gradNorm = torch.sqrt(sum(torch.sum(p.grad ** 2) for p in net.parameters()))
+    # per-tensor norms in one fused foreach kernel, then a single reduction over them; both stay on the device
+    params = list(net.parameters())
+    pNorm = torch.linalg.vector_norm(torch.stack(torch._foreach_norm(params)))
+    gradNorm = torch.linalg.vector_norm(torch.stack(torch._foreach_norm([p.grad for p in params if p.grad is not None])))
     return pNorm, gradNorm
 
 
+def clipGradNorm_(net, gradNorm, max_norm):
+    """
+    clip_grad_norm_ given the already computed total gradient norm, so it is not reduced twice
+    """
+    clip_coef = torch.clamp(max_norm / (gradNorm + 1e-6), max=1.0)
+    torch._foreach_mul_([p.grad for p in net.parameters() if p.grad is not None], clip_coef)
+
+
+def _cpu_copy(obj):
+    """
+    Snapshot of a (nested) state_dict on the host, safe to serialize while training updates the originals
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _cpu_copy(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_copy(v) for v in obj)
+    return obj
+
+
+def _save_checkpoint(save_dict, path, prev_path):
+    # write beside the target and rename, so a crash mid-write never leaves a truncated checkpoint;
+    # the previous one is only deleted once the new one is in place
+    torch.save(save_dict, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    if prev_path is not None and os.path.exists(prev_path):
+        os.remove(prev_path)
+
+
 def weights_init(m):
     """
     xavier initialization
@@ -72,37 +108,79 @@ def weights_init(m):
 '''
 models
 '''
+@torch.jit.script
 def normal_kl(mean1, logvar1, mean2, logvar2):
     """
     KL divergence between normal distributions parameterized by mean and log-variance.
+    Scripted so the whole expression fuses into a single pointwise kernel.
     """
+    d = mean1 - mean2
     return 0.5 * (-1.0 + logvar2 - logvar1 + torch.exp(logvar1 - logvar2)
-                + (mean1 - mean2)**2 * torch.exp(-logvar2))
+                + d * d * torch.exp(-logvar2))
+
+_INV_SQRT2 = 1. / math.sqrt(2.)
+
+def _std_normal_cdf(x):
+    return 0.5 * (1. + torch.erf(x * _INV_SQRT2))
 
 def discretized_gaussian_log_likelihood(x, *, means, log_scales):
     # Assumes data is integers [0, 1]
     assert x.shape == means.shape == log_scales.shape
-    px0 = Normal(torch.zeros_like(means), torch.ones_like(log_scales))
 
     centered_x = x - means
     inv_stdv = torch.exp(-log_scales)
     plus_in = inv_stdv * (centered_x + 0.5)
-    cdf_plus = px0.cdf(plus_in)
+    cdf_plus = _std_normal_cdf(plus_in)
     min_in = inv_stdv * (centered_x - .5)
-    cdf_min = px0.cdf(min_in)
-    log_cdf_plus = torch.log(torch.max(cdf_plus, torch.ones_like(cdf_plus)*1e-12))
-    log_one_minus_cdf_min = torch.log(torch.max(1. - cdf_min,  torch.ones_like(cdf_min)*1e-12))
+    cdf_min = _std_normal_cdf(min_in)
+    log_cdf_plus = torch.log(torch.clamp_min(cdf_plus, 1e-12))
+    log_one_minus_cdf_min = torch.log(torch.clamp_min(1. - cdf_min, 1e-12))
     cdf_delta = cdf_plus - cdf_min
 
     log_probs = torch.where(
     x < 0.001, log_cdf_plus,
     torch.where(x > 0.999, log_one_minus_cdf_min,
-             torch.log(torch.max(cdf_delta, torch.ones_like(cdf_delta)*1e-12))))
+             torch.log(torch.clamp_min(cdf_delta, 1e-12))))
     assert log_probs.shape == x.shape
     return log_probs
 
-class GaussianDiffusion:
+@torch.jit.script
+def _lincomb(a, x, b, y):
+    """
+    a * x + b * y in one fused pointwise kernel; a, b are [B, 1, ...] coefficients
+    """
+    return a * x + b * y
+
+@torch.jit.script
+def _lindiff(a, x, b, y):
+    """
+    a * x - b * y in one fused pointwise kernel; a, b are [B, 1, ...] coefficients
+    """
+    return a * x - b * y
+
+@torch.jit.script
+def _ddpm_step(model_output, x_t, noise: Optional[torch.Tensor], sqrt_recip, sqrt_recipm1, coef1, coef2, sigma,
+               clip_denoised: bool):
+    """
+    One reverse step x_t -> x_{t-1} for an eps-predicting model, given the
+    per-step coefficients; fused by the JIT into a few pointwise kernels.
+    noise is None for the last step (t == 0), which is noiseless.
+    """
+    x_recon = sqrt_recip * x_t - sqrt_recipm1 * model_output
+    if clip_denoised:
+        x_recon = torch.clamp(x_recon, -.5, .5)
+    mean = coef1 * x_recon + coef2 * x_t
+    if noise is None:
+        return mean
+    return mean + sigma * noise
+
+class GaussianDiffusion(nn.Module):
+    """
+    The noise schedule is registered as (non-persistent) buffers, so it follows the
+    parent `Model` across devices and is never copied over per step.
+    """
     def __init__(self,betas, loss_type, model_mean_type, model_var_type):
+        super().__init__()
         self.loss_type = loss_type
         self.model_mean_type = model_mean_type
         self.model_var_type = model_var_type
@@ -115,31 +193,37 @@ class GaussianDiffusion:
         # initialize twice the actual length so we can keep running for eval
         # betas = np.concatenate([betas, np.full_like(betas[:int(0.2*len(betas))], betas[-1])])
 
+        # the whole schedule in float64 torch, cast to float32 once per buffer in _register
+        betas = torch.from_numpy(betas)
         alphas = 1. - betas
-        alphas_cumprod = torch.from_numpy(np.cumprod(alphas, axis=0)).float()
-        alphas_cumprod_prev = torch.from_numpy(np.append(1., alphas_cumprod[:-1])).float()
+        alphas_cumprod = torch.cumprod(alphas, dim=0)
+        alphas_cumprod_prev = torch.cat([alphas_cumprod.new_ones(1), alphas_cumprod[:-1]])
 
-        self.betas = torch.from_numpy(betas).float()
-        self.alphas_cumprod = alphas_cumprod.float()
-        self.alphas_cumprod_prev = alphas_cumprod_prev.float()
+        self._register('betas', betas)
+        self._register('alphas_cumprod', alphas_cumprod)
+        self._register('alphas_cumprod_prev', alphas_cumprod_prev)
 
         # calculations for diffusion q(x_t | x_{t-1}) and others
-        self.sqrt_alphas_cumprod = torch.sqrt(alphas_cumprod).float()
-        self.sqrt_one_minus_alphas_cumprod = torch.sqrt(1. - alphas_cumprod).float()
-        self.log_one_minus_alphas_cumprod = torch.log(1. - alphas_cumprod).float()
-        self.sqrt_recip_alphas_cumprod = torch.sqrt(1. / alphas_cumprod).float()
-        self.sqrt_recipm1_alphas_cumprod = torch.sqrt(1. / alphas_cumprod - 1).float()
-
-        betas = torch.from_numpy(betas).float()
-        alphas = torch.from_numpy(alphas).float()
+        self._register('sqrt_alphas_cumprod', torch.sqrt(alphas_cumprod))
+        self._register('sqrt_one_minus_alphas_cumprod', torch.sqrt(1. - alphas_cumprod))
+        self._register('log_one_minus_alphas_cumprod', torch.log(1. - alphas_cumprod))
+        self._register('sqrt_recip_alphas_cumprod', torch.sqrt(1. / alphas_cumprod))
+        self._register('sqrt_recipm1_alphas_cumprod', torch.sqrt(1. / alphas_cumprod - 1))
+
         # calculations for posterior q(x_{t-1} | x_t, x_0)
         posterior_variance = betas * (1. - alphas_cumprod_prev) / (1. - alphas_cumprod)
         # above: equal to 1. / (1. / (1. - alpha_cumprod_tm1) + alpha_t / beta_t)
-        self.posterior_variance = posterior_variance
+        self._register('posterior_variance', posterior_variance)
         # below: log calculation clipped because the posterior variance is 0 at the beginning of the diffusion chain
-        self.posterior_log_variance_clipped = torch.log(torch.max(posterior_variance, 1e-20 * torch.ones_like(posterior_variance)))
-        self.posterior_mean_coef1 = betas * torch.sqrt(alphas_cumprod_prev) / (1. - alphas_cumprod)
-        self.posterior_mean_coef2 = (1. - alphas_cumprod_prev) * torch.sqrt(alphas) / (1. - alphas_cumprod)
+        self._register('posterior_log_variance_clipped', torch.log(torch.clamp_min(posterior_variance, 1e-20)))
+        # for fixedlarge, we set the initial (log-)variance like so to get a better decoder log likelihood
+        self._register('posterior_log_variance_fixedlarge', torch.log(torch.cat([posterior_variance[1:2], betas[1:]])))
+        self._register('posterior_mean_coef1', betas * torch.sqrt(alphas_cumprod_prev) / (1. - alphas_cumprod))
+        self._register('posterior_mean_coef2', (1. - alphas_cumprod_prev) * torch.sqrt(alphas) / (1. - alphas_cumprod))
+
+    def _register(self, name, tensor):
+        # not persistent: the schedule is rebuilt from betas, so checkpoints stay unchanged
+        self.register_buffer(name, tensor.float(), persistent=False)
 
     @staticmethod
     def _extract(a, t, x_shape):
@@ -148,17 +232,15 @@ class GaussianDiffusion:
         then reshape to [batch_size, 1, 1, 1, 1, ...] for broadcasting purposes.
         """
         bs, = t.shape
-        assert x_shape[0] == bs
         out = torch.gather(a, 0, t)
-        assert out.shape == torch.Size([bs])
         return torch.reshape(out, [bs] + ((len(x_shape) - 1) * [1]))
 
 
 
     def q_mean_variance(self, x_start, t):
-        mean = self._extract(self.sqrt_alphas_cumprod.to(x_start.device), t, x_start.shape) * x_start
-        variance = self._extract(1. - self.alphas_cumprod.to(x_start.device), t, x_start.shape)
-        log_variance = self._extract(self.log_one_minus_alphas_cumprod.to(x_start.device), t, x_start.shape)
+        mean = self._extract(self.sqrt_alphas_cumprod, t, x_start.shape) * x_start
+        variance = self._extract(1. - self.alphas_cumprod, t, x_start.shape)
+        log_variance = self._extract(self.log_one_minus_alphas_cumprod, t, x_start.shape)
         return mean, variance, log_variance
 
     def q_sample(self, x_start, t, noise=None):
@@ -167,26 +249,18 @@ class GaussianDiffusion:
         """
         if noise is None:
             noise = torch.randn(x_start.shape, device=x_start.device)
-        assert noise.shape == x_start.shape
-        return (
-                self._extract(self.sqrt_alphas_cumprod.to(x_start.device), t, x_start.shape) * x_start +
-                self._extract(self.sqrt_one_minus_alphas_cumprod.to(x_start.device), t, x_start.shape) * noise
-        )
+        return _lincomb(self._extract(self.sqrt_alphas_cumprod, t, x_start.shape), x_start,
+                        self._extract(self.sqrt_one_minus_alphas_cumprod, t, x_start.shape), noise)
 
 
     def q_posterior_mean_variance(self, x_start, x_t, t):
         """
         Compute the mean and variance of the diffusion posterior q(x_{t-1} | x_t, x_0)
         """
-        assert x_start.shape == x_t.shape
-        posterior_mean = (
-                self._extract(self.posterior_mean_coef1.to(x_start.device), t, x_t.shape) * x_start +
-                self._extract(self.posterior_mean_coef2.to(x_start.device), t, x_t.shape) * x_t
-        )
-        posterior_variance = self._extract(self.posterior_variance.to(x_start.device), t, x_t.shape)
-        posterior_log_variance_clipped = self._extract(self.posterior_log_variance_clipped.to(x_start.device), t, x_t.shape)
-        assert (posterior_mean.shape[0] == posterior_variance.shape[0] == posterior_log_variance_clipped.shape[0] ==
-                x_start.shape[0])
+        posterior_mean = _lincomb(self._extract(self.posterior_mean_coef1, t, x_t.shape), x_start,
+                                  self._extract(self.posterior_mean_coef2, t, x_t.shape), x_t)
+        posterior_variance = self._extract(self.posterior_variance, t, x_t.shape)
+        posterior_log_variance_clipped = self._extract(self.posterior_log_variance_clipped, t, x_t.shape)
         return posterior_mean, posterior_variance, posterior_log_variance_clipped
 
 
@@ -195,18 +269,16 @@ class GaussianDiffusion:
         model_output = denoise_fn(data, t)
 
 
-        if self.model_var_type in ['fixedsmall', 'fixedlarge']:
-            # below: only log_variance is used in the KL computations
-            model_variance, model_log_variance = {
-                # for fixedlarge, we set the initial (log-)variance like so to get a better decoder log likelihood
-                'fixedlarge': (self.betas.to(data.device),
-                               torch.log(torch.cat([self.posterior_variance[1:2], self.betas[1:]])).to(data.device)),
-                'fixedsmall': (self.posterior_variance.to(data.device), self.posterior_log_variance_clipped.to(data.device)),
-            }[self.model_var_type]
-            model_variance = self._extract(model_variance, t, data.shape) * torch.ones_like(data)
-            model_log_variance = self._extract(model_log_variance, t, data.shape) * torch.ones_like(data)
+        # below: only log_variance is used in the KL computations
+        if self.model_var_type == 'fixedlarge':
+            model_variance, model_log_variance = self.betas, self.posterior_log_variance_fixedlarge
+        elif self.model_var_type == 'fixedsmall':
+            model_variance, model_log_variance = self.posterior_variance, self.posterior_log_variance_clipped
         else:
             raise NotImplementedError(self.model_var_type)
+        # kept as [B, 1, ...]: every consumer broadcasts them against data
+        model_variance = self._extract(model_variance, t, data.shape)
+        model_log_variance = self._extract(model_log_variance, t, data.shape)
 
         if self.model_mean_type == 'eps':
             x_recon = self._predict_xstart_from_eps(data, t=t, eps=model_output)
@@ -218,23 +290,61 @@ class GaussianDiffusion:
         else:
             raise NotImplementedError(self.loss_type)
 
-
-        assert model_mean.shape == x_recon.shape == data.shape
-        assert model_variance.shape == model_log_variance.shape == data.shape
         if return_pred_xstart:
             return model_mean, model_variance, model_log_variance, x_recon
         else:
             return model_mean, model_variance, model_log_variance
 
     def _predict_xstart_from_eps(self, x_t, t, eps):
-        assert x_t.shape == eps.shape
-        return (
-                self._extract(self.sqrt_recip_alphas_cumprod.to(x_t.device), t, x_t.shape) * x_t -
-                self._extract(self.sqrt_recipm1_alphas_cumprod.to(x_t.device), t, x_t.shape) * eps
-        )
+        return _lindiff(self._extract(self.sqrt_recip_alphas_cumprod, t, x_t.shape), x_t,
+                        self._extract(self.sqrt_recipm1_alphas_cumprod, t, x_t.shape), eps)
 
     ''' samples '''
 
+    def _reverse_step_coefs(self):
+        """
+        Per-timestep coefficients of `_ddpm_step`, each of shape [T]; sigma is zero
+        at t == 0 so the last step adds no noise.
+        """
+        if self.model_mean_type != 'eps':
+            raise NotImplementedError(self.model_mean_type)
+        if self.model_var_type == 'fixedlarge':
+            model_log_variance = self.posterior_log_variance_fixedlarge
+        elif self.model_var_type == 'fixedsmall':
+            model_log_variance = self.posterior_log_variance_clipped
+        else:
+            raise NotImplementedError(self.model_var_type)
+        sigma = torch.exp(0.5 * model_log_variance)
+        sigma[0] = 0.
+        return (self.sqrt_recip_alphas_cumprod, self.sqrt_recipm1_alphas_cumprod,
+                self.posterior_mean_coef1, self.posterior_mean_coef2, sigma)
+
+    def _p_sample_step(self, denoise_fn, img_t, t, t_, coefs, noise_fn, noise_buf, clip_denoised):
+        """
+        p_sample for a timestep shared by the whole batch: the coefficients are indexed
+        with the int t, no per-coefficient gather over the batch tensor t_.
+        noise_buf, if given, is refilled in place instead of calling noise_fn; no noise
+        is drawn at all for t == 0.
+        """
+        model_output = denoise_fn(img_t, t_)
+        if t == 0:
+            noise = None
+        elif noise_buf is not None:
+            noise = noise_buf.normal_()
+        else:
+            noise = noise_fn(size=img_t.shape, dtype=img_t.dtype, device=img_t.device)
+        return _ddpm_step(model_output, img_t, noise, *[c[t] for c in coefs], clip_denoised)
+
+    @staticmethod
+    def _timestep_rows(total_steps, batch_size, device):
+        # row t is the batch of timesteps for step t; built once, so a step only takes a view
+        return torch.arange(total_steps, device=device)[:, None].repeat(1, batch_size)
+
+    @staticmethod
+    def _noise_buffer(noise_fn, shape, device):
+        # only the default gaussian can be drawn in place; a custom noise_fn is called every step
+        return torch.empty(shape, dtype=torch.float, device=device) if noise_fn is torch.randn else None
+
     def p_sample(self, denoise_fn, data, t, noise_fn, clip_denoised=False, return_pred_xstart=False):
         """
         Sample from the model
@@ -242,12 +352,10 @@ class GaussianDiffusion:
         model_mean, _, model_log_variance, pred_xstart = self.p_mean_variance(denoise_fn, data=data, t=t, clip_denoised=clip_denoised,
                                                                  return_pred_xstart=True)
         noise = noise_fn(size=data.shape, dtype=data.dtype, device=data.device)
-        assert noise.shape == data.shape
         # no noise when t == 0
         nonzero_mask = torch.reshape(1 - (t == 0).float(), [data.shape[0]] + [1] * (len(data.shape) - 1))
 
         sample = model_mean + nonzero_mask * torch.exp(0.5 * model_log_variance) * noise
-        assert sample.shape == pred_xstart.shape
         return (sample, pred_xstart) if return_pred_xstart else sample
 
 
@@ -259,12 +367,14 @@ class GaussianDiffusion:
 
         """
 
-        assert isinstance(shape, (tuple, list))
+        shape = tuple(shape)
+        total_steps = self.num_timesteps if not keep_running else len(self.betas)
+        coefs = self._reverse_step_coefs()
         img_t = noise_fn(size=shape, dtype=torch.float, device=device)
-        for t in reversed(range(0, self.num_timesteps if not keep_running else len(self.betas))):
-            t_ = torch.empty(shape[0], dtype=torch.int64, device=device).fill_(t)
-            img_t = self.p_sample(denoise_fn=denoise_fn, data=img_t,t=t_, noise_fn=noise_fn,
-                                  clip_denoised=clip_denoised, return_pred_xstart=False)
+        t_rows = self._timestep_rows(total_steps, shape[0], device)
+        noise_buf = self._noise_buffer(noise_fn, shape, device)
+        for t in reversed(range(0, total_steps)):
+            img_t = self._p_sample_step(denoise_fn, img_t, t, t_rows[t], coefs, noise_fn, noise_buf, clip_denoised)
 
         assert img_t.shape == shape
         return img_t
@@ -278,18 +388,17 @@ class GaussianDiffusion:
           repeat_noise_steps (int): Number of denoising timesteps in which the same noise
             is used across the batch. If >= 0, the initial noise is the same for all batch elemements.
         """
-        assert isinstance(shape, (tuple, list))
-
+        shape = tuple(shape)
         total_steps =  self.num_timesteps if not keep_running else len(self.betas)
 
+        coefs = self._reverse_step_coefs()
         img_t = noise_fn(size=shape, dtype=torch.float, device=device)
         imgs = [img_t]
+        t_rows = self._timestep_rows(total_steps, shape[0], device)
+        noise_buf = self._noise_buffer(noise_fn, shape, device)
         for t in reversed(range(0,total_steps)):
 
-            t_ = torch.empty(shape[0], dtype=torch.int64, device=device).fill_(t)
-            img_t = self.p_sample(denoise_fn=denoise_fn, data=img_t, t=t_, noise_fn=noise_fn,
-                                  clip_denoised=clip_denoised,
-                                  return_pred_xstart=False)
+            img_t = self._p_sample_step(denoise_fn, img_t, t, t_rows[t], coefs, noise_fn, noise_buf, clip_denoised)
             if t % freq == 0 or t == total_steps-1:
                 imgs.append(img_t)
 
@@ -350,28 +459,35 @@ class GaussianDiffusion:
             assert kl_prior.shape == x_start.shape
             return kl_prior.mean(dim=list(range(1, len(kl_prior.shape)))) / np.log(2.)
 
-    def calc_bpd_loop(self, denoise_fn, x_start, clip_denoised=True):
+    def calc_bpd_loop(self, denoise_fn, x_start, clip_denoised=True, t_chunk=1):
+        """
+        t_chunk: number of timesteps evaluated per denoise_fn call, by tiling x_start along the batch
+        """
 
         with torch.no_grad():
             B, T = x_start.shape[0], self.num_timesteps
+            mean_dims = list(range(1, len(x_start.shape)))
 
             vals_bt_, mse_bt_= torch.zeros([B, T], device=x_start.device), torch.zeros([B, T], device=x_start.device)
-            for t in reversed(range(T)):
-
-                t_b = torch.empty(B, dtype=torch.int64, device=x_start.device).fill_(t)
-                # Calculate VLB term at the current timestep
+            timesteps = list(reversed(range(T)))
+            # all timesteps (descending, each repeated B times) built once; every chunk is a slice of it
+            t_all = torch.arange(T - 1, -1, -1, device=x_start.device).repeat_interleave(B)
+            for i in range(0, T, t_chunk):
+                ts = timesteps[i:i + t_chunk]
+                K = len(ts)
+                x_rep = x_start.repeat(K, *([1] * (len(x_start.shape) - 1)))
+                t_b = t_all[i * B:(i + K) * B]
+                # Calculate VLB term at the current timesteps
                 new_vals_b, pred_xstart = self._vb_terms_bpd(
-                    denoise_fn, data_start=x_start, data_t=self.q_sample(x_start=x_start, t=t_b), t=t_b,
+                    denoise_fn, data_start=x_rep, data_t=self.q_sample(x_start=x_rep, t=t_b), t=t_b,
                     clip_denoised=clip_denoised, return_pred_xstart=True)
                 # MSE for progressive prediction loss
-                assert pred_xstart.shape == x_start.shape
-                new_mse_b = ((pred_xstart-x_start)**2).mean(dim=list(range(1, len(x_start.shape))))
-                assert new_vals_b.shape == new_mse_b.shape ==  torch.Size([B])
-                # Insert the calculated term into the tensor of all terms
-                mask_bt = t_b[:, None]==torch.arange(T, device=t_b.device)[None, :].float()
-                vals_bt_ = vals_bt_ * (~mask_bt) + new_vals_b[:, None] * mask_bt
-                mse_bt_ = mse_bt_ * (~mask_bt) + new_mse_b[:, None] * mask_bt
-                assert mask_bt.shape == vals_bt_.shape == vals_bt_.shape == torch.Size([B, T])
+                assert pred_xstart.shape == x_rep.shape
+                new_mse_b = ((pred_xstart-x_rep)**2).mean(dim=mean_dims)
+                assert new_vals_b.shape == new_mse_b.shape ==  torch.Size([K * B])
+                # Insert the calculated terms into the tensor of all terms
+                vals_bt_[:, ts] = new_vals_b.view(K, B).t()
+                mse_bt_[:, ts] = new_mse_b.view(K, B).t()
 
             prior_bpd_b = self._prior_bpd(x_start)
             total_bpd_b = vals_bt_.sum(dim=1) + prior_bpd_b
@@ -394,10 +510,10 @@ class ImageEncoder(nn.Module):
                     nn.Conv2d(current_channels, out_ch, kernel_size=3, stride=1, padding=1),
                     nn.BatchNorm2d(out_ch),
                     nn.SiLU(),
-                    nn.Conv2d(out_ch, out_ch, kernel_size=3, stride=1, padding=1),
+                    # downsample in the conv itself rather than a separate AvgPool2d pass
+                    nn.Conv2d(out_ch, out_ch, kernel_size=3, stride=2, padding=1),
                     nn.BatchNorm2d(out_ch),
                     nn.SiLU(),
-                    nn.AvgPool2d(kernel_size=2, stride=2)
                 )
             )
             current_channels = out_ch
@@ -475,26 +591,22 @@ class PVCNN2(PVCNN2Base):
         # inputs: (B, N, 3)
         # guide_features: list of (B, C, H, W)
         if guide_features is not None:
-            # coords must be in range [-1, 1]
-            coords = inputs[:, :, :2].unsqueeze(1) # (B, 1, N, 2)
-            
-            point_features_list = []
+            # coords must be in range [-1, 1]; (B, N, 1, 2) so each grid_sample returns (B, C, N, 1)
+            coords = inputs[:, :, None, :2]
+            N = inputs.shape[1]
+
+            # everything in the (B, C, N) layout PVCNN2Base takes, joined by a single cat
+            feats = [inputs.transpose(1, 2)] # (B, 3, N)
             for feat_map in guide_features:
                 # feat_map: (B, C, H, W)
-                sampled_features = nn.functional.grid_sample(
-                    feat_map, coords, mode='bilinear', padding_mode='border', align_corners=False
-                ) # (B, C, 1, N) 
                 # TODO: handle the case when coords are out of range
-                point_features_list.append(sampled_features.squeeze(2)) # (B, C, N)
-            
-            img_feats = torch.cat(point_features_list, dim=1) # (B, C_total, N)
-            
-            img_feats = img_feats.transpose(1, 2) # (B, N, C_total)
-            
-            N = inputs.shape[1]
-            global_feat_expanded = global_feat.unsqueeze(1).expand(-1, N, -1)
-            
-            inputs = torch.cat([inputs, img_feats, global_feat_expanded], dim=2).transpose(1, 2)
+                feats.append(nn.functional.grid_sample(
+                    feat_map, coords, mode='bilinear', padding_mode='border', align_corners=False
+                ).squeeze(-1)) # (B, C, N)
+            # broadcast straight into the channel-major layout; cat reads the view, nothing (B, N, C) is built
+            feats.append(global_feat.unsqueeze(-1).expand(-1, -1, N)) # (B, C_global, N)
+
+            inputs = torch.cat(feats, dim=1)
             # inputs: (B, 3 + C_total, N)
         
         # Now call the original forward method of the base class
@@ -511,6 +623,8 @@ class Model(nn.Module):
         if self.use_img_guide:
             out_channels_list = [32, 64, 128]
             self.image_encoder = ImageEncoder(in_channels=1, out_channels_list=out_channels_list)
+            # NHWC convs run on the tensor cores without layout transposes
+            self.image_encoder.to(memory_format=torch.channels_last)
             # local features (including original image) + global features
             extra_feature_channels = extra_feature_channels + (1 + sum(out_channels_list)) + out_channels_list[-1]
         else:
@@ -518,12 +632,31 @@ class Model(nn.Module):
 
         self.model = PVCNN2(num_classes=args.nc, embed_dim=args.embed_dim, use_att=args.attention,
                             dropout=args.dropout, extra_feature_channels=extra_feature_channels)
+        self.model.activation_checkpoint = args.activation_checkpoint
+        # bf16/fp16 autocast around the network only; the schedule math stays in fp32
+        if args.bf16 and args.fp16:
+            raise ValueError("--bf16 and --fp16 are mutually exclusive.")
+        self.amp_dtype = torch.bfloat16 if args.bf16 else torch.float16 if args.fp16 else None
+
+    def compile_networks(self):
+        """
+        torch.compile the denoiser and image encoder; call after device placement and the
+        multi_gpu_wrapper, so DDP-wrapped modules are compiled with their bucket hooks.
+        Compiled in place so state_dict keys (and checkpoints) are unchanged; the networks see
+        fixed shapes at every training step and every reverse-chain step, so CUDA graphs replay.
+        """
+        self.model.compile(mode='reduce-overhead', dynamic=False)
+        if self.image_encoder is not None:
+            self.image_encoder.compile(mode='reduce-overhead', dynamic=False)
 
     def prior_kl(self, x0):
         return self.diffusion._prior_bpd(x0)
 
-    def all_kl(self, x0, clip_denoised=True):
-        total_bpd_b, vals_bt, prior_bpd_b, mse_bt =  self.diffusion.calc_bpd_loop(self._denoise, x0, clip_denoised)
+    def all_kl(self, x0, clip_denoised=True, t_chunk=1):
+        # the image guide is per sample and would not follow x0 tiled over timesteps,
+        # so t_chunk only applies to the unguided model
+        t_chunk = 1 if self.use_img_guide else t_chunk
+        total_bpd_b, vals_bt, prior_bpd_b, mse_bt =  self.diffusion.calc_bpd_loop(self._denoise, x0, clip_denoised, t_chunk)
 
         return {
             'total_bpd_b': total_bpd_b,
@@ -533,30 +666,53 @@ class Model(nn.Module):
         }
 
 
-    def _denoise(self, data, t, guide_img=None):
-        B, D, N = data.shape
-        assert data.dtype == torch.float
-        assert t.shape == torch.Size([B]) and t.dtype == torch.int64
+    def _autocast(self, device):
+        # without --bf16/--fp16 this leaves any autocast region of the caller in effect
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=device.type, dtype=self.amp_dtype)
 
-        if self.use_img_guide:
+    def _encode_guide(self, guide_img):
+        # NHWC like the encoder weights; a no-op for inputs that already are (the prefetched ones)
+        guide_img = guide_img.contiguous(memory_format=torch.channels_last)
+        with self._autocast(guide_img.device):
+            return self.image_encoder(guide_img)
+
+    def _chain_guide(self, guide_img):
+        """
+        guide_img encoded once for a whole reverse chain; cloned because with --compile the
+        encoder outputs live in the CUDA-graph pool, where the chain's later replays overwrite them
+        """
+        guide_features, global_feat = self._encode_guide(guide_img)
+        return [f.clone() for f in guide_features], global_feat.clone()
+
+    def _denoise(self, data, t, guide_img=None, guide=None):
+        """
+        guide: (guide_features, global_feat) from `_encode_guide`, used instead of encoding
+        guide_img again when the same image conditions many calls (the reverse chain)
+        """
+        if self.use_img_guide and guide is None:
             if guide_img is None:
                 raise ValueError("Image guide is enabled, but no guide_img provided to _denoise.")
-            guide_features, global_feat = self.image_encoder(guide_img)
-            # The forward of our modified PVCNN2 expects (B, N, 3)
-            out = self.model(data.transpose(1, 2), t, guide_features, global_feat)
-        else:
-            # The original PVCNN2Base expects (B, C, N), so we pass `data` directly
-            out = self.model(data, t)
+            guide = self._encode_guide(guide_img)
 
-        assert out.shape == torch.Size([B, D, N])
-        return out
+        with self._autocast(data.device):
+            if self.use_img_guide:
+                guide_features, global_feat = guide
+                # The forward of our modified PVCNN2 expects (B, N, 3)
+                out = self.model(data.transpose(1, 2), t, guide_features, global_feat)
+            else:
+                # The original PVCNN2Base expects (B, C, N), so we pass `data` directly
+                out = self.model(data, t)
+        return out.float()
 
     def get_loss_iter(self, data, noises=None, guide_img=None):
         B, D, N = data.shape
         t = torch.randint(0, self.diffusion.num_timesteps, size=(B,), device=data.device)
 
         if noises is not None:
-            noises[t!=0] = torch.randn((t!=0).sum(), *noises.shape[1:]).to(noises)
+            # fresh noise drawn on the device for t != 0, without a host sync on the mask
+            noises = torch.where((t != 0).view(B, 1, 1), torch.randn_like(noises), noises)
 
         losses = self.diffusion.p_losses(
             denoise_fn=lambda data, t: self._denoise(data, t, guide_img), 
@@ -571,7 +727,9 @@ class Model(nn.Module):
         if self.use_img_guide and guide_img is None:
             raise ValueError("Image guide is enabled, but no guide_img provided to gen_samples.")
         
-        denoise_fn_wrapper = lambda data, t: self._denoise(data, t, guide_img)
+        # guide_img is fixed over the reverse chain: encode it once, not at every step
+        guide = self._chain_guide(guide_img) if self.use_img_guide else None
+        denoise_fn_wrapper = lambda data, t: self._denoise(data, t, guide=guide)
         return self.diffusion.p_sample_loop(denoise_fn_wrapper, shape=shape, device=device, noise_fn=noise_fn,
                                             clip_denoised=clip_denoised,
                                             keep_running=keep_running)
@@ -581,7 +739,8 @@ class Model(nn.Module):
         if self.use_img_guide and guide_img is None:
             raise ValueError("Image guide is enabled, but no guide_img provided to gen_sample_traj.")
             
-        denoise_fn_wrapper = lambda data, t: self._denoise(data, t, guide_img)
+        guide = self._chain_guide(guide_img) if self.use_img_guide else None
+        denoise_fn_wrapper = lambda data, t: self._denoise(data, t, guide=guide)
         return self.diffusion.p_sample_loop_trajectory(denoise_fn_wrapper, shape=shape, device=device, noise_fn=noise_fn, freq=freq,
                                                        clip_denoised=clip_denoised,
                                                        keep_running=keep_running)
@@ -592,8 +751,44 @@ class Model(nn.Module):
     def eval(self):
         self.model.eval()
 
+    def no_sync(self):
+        """
+        Skip the DDP gradient all-reduce of every wrapped submodule; gradients accumulate locally
+        """
+        stack = contextlib.ExitStack()
+        for m in (self.model, self.image_encoder):
+            if isinstance(m, nn.parallel.DistributedDataParallel):
+                stack.enter_context(m.no_sync())
+        return stack
+
+    @staticmethod
+    def _unwrap(m):
+        return m.module if isinstance(m, (nn.DataParallel, nn.parallel.DistributedDataParallel)) else m
+
+    def unwrapped_state_dict(self):
+        """
+        state_dict without the DataParallel/DDP 'module.' level, the same for every distribution_type
+        """
+        return {'%s.%s' % (name, k): v for name, child in self.named_children()
+                for k, v in self._unwrap(child).state_dict().items()}
+
+    def load_unwrapped_state_dict(self, state_dict):
+        """
+        Loads an `unwrapped_state_dict`, or a state_dict saved from the wrapped networks
+        """
+        for name, child in self.named_children():
+            prefixes = (name + '.module.', name + '.')
+            child_state = {}
+            for k, v in state_dict.items():
+                prefix = next((p for p in prefixes if k.startswith(p)), None)
+                if prefix is not None:
+                    child_state[k[len(prefix):]] = v
+            self._unwrap(child).load_state_dict(child_state)
+
     def multi_gpu_wrapper(self, f):
         self.model = f(self.model)
+        if self.image_encoder is not None:
+            self.image_encoder = f(self.image_encoder)
 
 
 def get_betas(schedule_type, b_start, b_end, time_num):
@@ -659,19 +854,64 @@ def get_dataloader(opt, train_dataset, test_dataset=None):
         train_sampler = None
         test_sampler = None
 
+    # page-locked batches so the .cuda(non_blocking=True) copies in train() overlap with compute;
+    # worker options only apply when there are workers (--workers 0 loads in the training process)
+    loader_kwargs = dict(num_workers=int(opt.workers), pin_memory=True)
+    if int(opt.workers) > 0:
+        loader_kwargs.update(persistent_workers=True, prefetch_factor=4)
+
     train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=opt.bs,sampler=train_sampler,
-                                                   shuffle=train_sampler is None, num_workers=int(opt.workers), drop_last=True)
+                                                   shuffle=train_sampler is None, drop_last=True, **loader_kwargs)
 
     if test_dataset is not None:
         test_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=opt.bs,sampler=test_sampler,
-                                                   shuffle=False, num_workers=int(opt.workers), drop_last=False)
+                                                   shuffle=False, drop_last=False, **loader_kwargs)
     else:
         test_dataloader = None
 
     return train_dataloader, test_dataloader, train_sampler, test_sampler
 
 
-def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
+class CUDAPrefetcher:
+    """
+    Iterates a DataLoader, copying the tensors under `keys` of batch i+1 to `device`
+    on a side stream while step i runs on the current stream; `memory_formats` maps
+    a key to the memory format its copy is made in
+    """
+    def __init__(self, loader, device, keys, memory_formats=None):
+        self.loader = loader
+        self.device = device
+        self.keys = keys
+        self.memory_formats = memory_formats or {}
+        self.stream = torch.cuda.Stream(device=device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _preload(self, it):
+        batch = next(it, None)
+        if batch is not None:
+            with torch.cuda.stream(self.stream):
+                for k in self.keys:
+                    batch[k] = batch[k].to(self.device, non_blocking=True,
+                                           memory_format=self.memory_formats.get(k, torch.preserve_format))
+        return batch
+
+    def __iter__(self):
+        it = iter(self.loader)
+        batch = self._preload(it)
+        while batch is not None:
+            current = torch.cuda.current_stream(self.device)
+            current.wait_stream(self.stream)
+            for k in self.keys:
+                # allocated on the side stream, used on the current one
+                batch[k].record_stream(current)
+            next_batch = self._preload(it)
+            yield batch
+            batch = next_batch
+
+
+def train(gpu, opt, output_dir, cfg, train_dataset, ge_dataset):
 
     set_seed(opt)
     logger = setup_logging(output_dir)
@@ -679,29 +919,39 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
     
     # ---dist---
     if opt.distribution_type == 'multi':
-        should_diag = gpu==0
+        # under torchrun gpu is the local rank; only global rank 0 writes, not rank 0 of every node
+        should_diag = dist.get_rank() == 0 if 'LOCAL_RANK' in os.environ else gpu==0
     else:
         should_diag = True
     if should_diag:
         outf_syn, = setup_output_subdirs(output_dir, 'syn')
 
     if opt.distribution_type == 'multi':
-        if opt.dist_url == "env://" and opt.rank == -1:
-            opt.rank = int(os.environ["RANK"])
+        if 'LOCAL_RANK' in os.environ:
+            # torchrun: RANK is already the global rank of this process
+            opt.rank = int(os.environ['RANK'])
+        else:
+            if opt.dist_url == "env://" and opt.rank == -1:
+                opt.rank = int(os.environ["RANK"])
 
-        base_rank =  opt.rank * opt.ngpus_per_node
-        opt.rank = base_rank + gpu
-        dist.init_process_group(backend=opt.dist_backend, init_method=opt.dist_url,
-                                world_size=opt.world_size, rank=opt.rank)
+            base_rank =  opt.rank * opt.ngpus_per_node
+            opt.rank = base_rank + gpu
+        if not dist.is_initialized():  # main() already joined the group under torchrun
+            dist.init_process_group(backend=opt.dist_backend, init_method=opt.dist_url,
+                                    world_size=opt.world_size, rank=opt.rank)
 
         opt.bs = int(opt.bs / opt.ngpus_per_node)
-        opt.workers = 0
 
         opt.saveIter =  int(opt.saveIter / opt.ngpus_per_node)
         opt.diagIter = int(opt.diagIter / opt.ngpus_per_node)
         opt.vizIter = int(opt.vizIter / opt.ngpus_per_node)
     # ---dist end---
 
+    if opt.workers is None:
+        # the host's cores split between the processes training on this node
+        ngpus = opt.ngpus_per_node if opt.distribution_type == 'multi' else 1
+        opt.workers = min(8, max(1, (os.cpu_count() or 1) // ngpus))
+
     ''' data '''
     dataloader, _, train_sampler, _ = get_dataloader(opt, train_dataset, None)
     # train_sampler is None in single process
@@ -715,8 +965,10 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
 
     if opt.distribution_type == 'multi':  # Multiple processes, single GPU per process
         def _transform_(m):
+            # same parameters every step (static_graph); BatchNorm stats stay per rank (broadcast_buffers)
             return nn.parallel.DistributedDataParallel(
-                m, device_ids=[gpu], output_device=gpu)
+                m, device_ids=[gpu], output_device=gpu, bucket_cap_mb=50,
+                gradient_as_bucket_view=True, static_graph=True, broadcast_buffers=False)
 
         torch.cuda.set_device(gpu)
         model.cuda(gpu)
@@ -735,10 +987,16 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
     else:
         raise ValueError('distribution_type = multi | single | None')
 
+    if opt.compile:
+        model.compile_networks()
+
     if should_diag:
         logger.info(opt)
 
-    optimizer= optim.Adam(model.parameters(), lr=opt.lr, weight_decay=opt.decay, betas=(opt.beta1, 0.999))
+    device = torch.device('cuda', gpu) if gpu is not None and opt.distribution_type != 'single' else torch.device('cuda')
+
+    # fused: one kernel updates every parameter (all of them are on the GPU by now)
+    optimizer= optim.Adam(model.parameters(), lr=opt.lr, weight_decay=opt.decay, betas=(opt.beta1, 0.999), fused=True)
 
     if opt.use_scheduler:
         lr_scheduler = optim.lr_scheduler.ExponentialLR(optimizer, opt.lr_gamma)
@@ -747,7 +1005,7 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
 
     if opt.model != '':
         ckpt = torch.load(opt.model)
-        model.load_state_dict(ckpt['model_state'])
+        model.load_unwrapped_state_dict(ckpt['model_state'])
         optimizer.load_state_dict(ckpt['optimizer_state'])
 
     if opt.model != '':
@@ -755,68 +1013,101 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
     else:
         start_epoch = 0
 
-    def new_x_chain(x, num_chain):
-        return torch.randn(num_chain, *x.shape[1:], device=x.device)
 
 
+    # one background writer: checkpoints are saved in order, off the training thread
+    saver = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    pending_save = None
+
+    prefetcher = CUDAPrefetcher(dataloader, device,
+                                ['train_points'] + (['guide_img'] if opt.use_img_guide else []),
+                                memory_formats={'guide_img': torch.channels_last})
+
+    # the visualization guide images are the same every vizIter: read and upload them once
+    sample_guide_img = None
+    if opt.use_img_guide and should_diag:
+        # guide_img comes from val dataset or train dataset
+        sample_guide_img = torch.stack([ge_dataset[i]['guide_img'] for i in range(1 if opt.fast_dev_run else 4)], dim=0)
+        # sample_guide_img = data['guide_img'][:1 if opt.fast_dev_run else 4]
+        sample_guide_img = sample_guide_img.to(device)
 
+    # fp16 gradients need loss scaling; with bf16 or fp32 the scaler is a pass-through
+    scaler = torch.cuda.amp.GradScaler(enabled=opt.fp16)
+
+    netpNorm = netgradNorm = torch.zeros((), device=device)
     for epoch in range(start_epoch, opt.niter):
-        avg_loss = 0
-        avg_netpNorm = 0
-        avg_netgradNorm = 0
+        avg_loss = torch.zeros((), device=device)
+        avg_netpNorm = torch.zeros((), device=device)
+        avg_netgradNorm = torch.zeros((), device=device)
+        num_steps = 0
 
         if opt.distribution_type == 'multi':
             train_sampler.set_epoch(epoch)
 
-        if lr_scheduler is not None:
-            lr_scheduler.step(epoch)
-
-        for i, data in enumerate(dataloader):
-            x = data['train_points'].transpose(1,2)
-            noises_batch = noises_init[data['idx']].transpose(1,2)
+        # batches arrive already on the device, copied by the prefetcher while the previous step ran
+        for i, data in enumerate(prefetcher):
 
             '''
             train diffusion
             '''
 
-            if opt.distribution_type == 'multi' or (opt.distribution_type is None and gpu is not None):
-                x = x.cuda(gpu)
-                noises_batch = noises_batch.cuda(gpu)
-            elif opt.distribution_type == 'single':
-                x = x.cuda()
-                noises_batch = noises_batch.cuda()
+            # (B, N, C) -> (B, C, N) on the device, after the contiguous pinned copy
+            x = data['train_points'].transpose(1, 2).contiguous()
 
+            # the noise is drawn on the device inside p_losses
             if opt.use_img_guide:
-                guide_img = data['guide_img'].cuda(gpu if gpu is not None else 0)
-                loss = model.get_loss_iter(x, noises_batch, guide_img).mean()
+                guide_img = data['guide_img']
+                loss = model.get_loss_iter(x, guide_img=guide_img).mean()
             else:
-                loss = model.get_loss_iter(x, noises_batch).mean()
+                loss = model.get_loss_iter(x).mean()
+
 
+            # gradients of accum_steps batches are summed locally and all-reduced once, on the boundary step;
+            # the last batch of the epoch always closes the group so no leftover gradients carry over
+            is_boundary = (i + 1) % opt.accum_steps == 0 or i == len(prefetcher) - 1
+            # averaged over the batches of this group, which is shorter for the epoch's leftover batches
+            group_size = min(opt.accum_steps, len(prefetcher) - (i // opt.accum_steps) * opt.accum_steps)
+            with contextlib.nullcontext() if is_boundary else model.no_sync():
+                scaler.scale(loss / group_size).backward()
 
-            optimizer.zero_grad()
-            loss.backward()
-            netpNorm, netgradNorm = getGradNorm(model)
-            if opt.grad_clip is not None:
-                torch.nn.utils.clip_grad_norm_(model.parameters(), opt.grad_clip)
+            if is_boundary:
+                # norms and clipping on the true (unscaled) gradients
+                scaler.unscale_(optimizer)
+                netpNorm, netgradNorm = getGradNorm(model)
+                if opt.grad_clip is not None:
+                    clipGradNorm_(model, netgradNorm, opt.grad_clip)
 
-            optimizer.step()
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
 
-            avg_loss += loss.item()
-            avg_netpNorm += netpNorm
-            avg_netgradNorm += netgradNorm
+                avg_netpNorm += netpNorm
+                avg_netgradNorm += netgradNorm
+                num_steps += 1
+
+            # running sums stay on the device; values are only read back (a sync) when logged
+            avg_loss += loss.detach()
 
             if i % opt.print_freq == 0 and should_diag:
 
+                # one device-to-host copy for all three logged scalars
+                step_loss, step_pNorm, step_gradNorm = torch.stack(
+                    [loss.detach().float(), netpNorm, netgradNorm]).tolist()
                 logger.info('[{:>3d}/{:>3d}][{:>3d}/{:>3d}]    loss: {:>10.4f},    '
                              'netpNorm: {:>10.2f},   netgradNorm: {:>10.2f}     '
                              .format(
-                        epoch, opt.niter, i, len(dataloader),loss.item(),
-                    netpNorm, netgradNorm,
+                        epoch, opt.niter, i, len(dataloader),step_loss,
+                    step_pNorm, step_gradNorm,
                         ))
 
+        # stepped before the checkpoint below, so a resumed run starts from the next epoch's lr
+        if lr_scheduler is not None:
+            lr_scheduler.step()
+
+        avg_loss, avg_netpNorm, avg_netgradNorm = torch.stack([avg_loss, avg_netpNorm, avg_netgradNorm]).tolist()
         avg_loss /= i + 1
-        avg_netpNorm /= i + 1
-        avg_netgradNorm /= i + 1
+        avg_netpNorm /= max(num_steps, 1)
+        avg_netgradNorm /= max(num_steps, 1)
         if (epoch + 1) % opt.diagIter == 0 and should_diag:
 
             logger.info('Diagnosis:')
@@ -856,19 +1147,11 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
             logger.info('Generation: check to eval mode')
 
             model.eval()
-            with torch.no_grad():
-                
-                sample_guide_img = None
-                if opt.use_img_guide:
-                    # guide_img comes from val dataset or train dataset
-                    sample_guide_img = torch.stack([ge_dataset[i]['guide_img'] for i in range(1 if opt.fast_dev_run else 4)], dim=0)
-                    # sample_guide_img = data['guide_img'][:1 if opt.fast_dev_run else 4]
-                    if gpu is not None:
-                        sample_guide_img = sample_guide_img.cuda(gpu)
-
+            # the 2 x T denoising steps of the visualization run in bf16, even when training is fp32
+            with torch.no_grad(), torch.autocast('cuda', dtype=torch.bfloat16, enabled=torch.cuda.is_bf16_supported()):
 
                 x_gen_eval = model.gen_samples(
-                    new_x_chain(x, 1 if opt.fast_dev_run else 4).shape, 
+                    (1 if opt.fast_dev_run else 4, *x.shape[1:]),
                     x.device, 
                     guide_img=sample_guide_img,
                     clip_denoised=False
@@ -876,7 +1159,7 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
                 
                 single_guide_img = sample_guide_img[0:1] if sample_guide_img is not None else None
                 x_gen_list = model.gen_sample_traj(
-                    new_x_chain(x, 1).shape, 
+                    (1, *x.shape[1:]),
                     x.device, 
                     freq=100, 
                     guide_img=single_guide_img,
@@ -926,24 +1209,27 @@ def train(gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset):
             if should_diag:
 
 
-                save_dict = {
+                # only the host snapshot is taken here; serializing it to disk runs on the saver thread
+                save_dict = _cpu_copy({
                     'epoch': epoch,
-                    'model_state': model.state_dict(),
+                    'model_state': model.unwrapped_state_dict(),
                     'optimizer_state': optimizer.state_dict()
-                }
-
-                torch.save(save_dict, '%s/epoch_%d.pth' % (output_dir, epoch))
+                })
+
+                # surface a failed earlier write here rather than at exit
+                if pending_save is not None:
+                    pending_save.result()
+                # delete the previous epoch once this one is written
+                prev_path = '%s/epoch_%d.pth' % (output_dir, epoch-opt.saveIter) if epoch > 0 else None
+                pending_save = saver.submit(_save_checkpoint, save_dict, '%s/epoch_%d.pth' % (output_dir, epoch), prev_path)
                 print('save model at epoch %d' % epoch)
-                # delete the previous epoch
-                if epoch > 0 and os.path.exists('%s/epoch_%d.pth' % (output_dir, epoch-opt.saveIter)):
-                    os.remove('%s/epoch_%d.pth' % (output_dir, epoch-opt.saveIter))
 
+            # DDP keeps the ranks' parameters identical, so there is nothing to reload from rank 0's file
 
-            if opt.distribution_type == 'multi':
-                dist.barrier()
-                map_location = {'cuda:%d' % 0: 'cuda:%d' % gpu}
-                model.load_state_dict(
-                    torch.load('%s/epoch_%d.pth' % (output_dir, epoch), map_location=map_location)['model_state'])
+    # the last checkpoint must be on disk before the process exits
+    saver.shutdown(wait=True)
+    if pending_save is not None:
+        pending_save.result()
 
     if opt.distribution_type == 'multi':
         dist.destroy_process_group()
@@ -961,22 +1247,38 @@ def main():
 
     exp_id = os.path.splitext(os.path.basename(__file__))[0]
     dir_id = os.path.dirname(__file__)
-    output_dir = get_output_dir(dir_id, exp_id)
+    if opt.distribution_type == 'multi' and 'LOCAL_RANK' in os.environ:
+        # every torchrun worker runs main(): join the process group first so that only global
+        # rank 0 clears and recreates the output directory, the others wait for its path
+        torch.cuda.set_device(int(os.environ['LOCAL_RANK']))
+        dist.init_process_group(backend=opt.dist_backend, init_method='env://')
+        shared = [get_output_dir(dir_id, exp_id) if dist.get_rank() == 0 else None]
+        dist.broadcast_object_list(shared, src=0)
+        output_dir, = shared
+        # other nodes may not share rank 0's filesystem, and every rank logs into the directory
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        output_dir = get_output_dir(dir_id, exp_id)
     # copy_source(__file__, output_dir)
 
     ''' workaround '''
     train_dataset, ge_dataset = get_dataset(opt, cfg)
-    noises_init = torch.randn(len(train_dataset), opt.npoints, opt.nc)
 
     if opt.dist_url == "env://" and opt.world_size == -1:
         opt.world_size = int(os.environ["WORLD_SIZE"])
 
-    if opt.distribution_type == 'multi':
+    if opt.distribution_type == 'multi' and 'LOCAL_RANK' in os.environ:
+        # launched by torchrun: this process is already one of the per-GPU workers
+        opt.ngpus_per_node = int(os.environ['LOCAL_WORLD_SIZE'])
+        opt.world_size = int(os.environ['WORLD_SIZE'])
+        opt.dist_url = 'env://'
+        train(int(os.environ['LOCAL_RANK']), opt, output_dir, cfg, train_dataset, ge_dataset)
+    elif opt.distribution_type == 'multi':
         opt.ngpus_per_node = torch.cuda.device_count()
         opt.world_size = opt.ngpus_per_node * opt.world_size
-        mp.spawn(train, nprocs=opt.ngpus_per_node, args=(opt, output_dir, noises_init, cfg, train_dataset, ge_dataset))
+        mp.spawn(train, nprocs=opt.ngpus_per_node, args=(opt, output_dir, cfg, train_dataset, ge_dataset))
     else:
-        train(opt.gpu, opt, output_dir, noises_init, cfg, train_dataset, ge_dataset)
+        train(opt.gpu, opt, output_dir, cfg, train_dataset, ge_dataset)
 
 
 
@@ -992,7 +1294,8 @@ def parse_args():
     parser.add_argument('--fast_dev_run', action='store_true', default=fast_dev_run)
 
     parser.add_argument('--bs', type=int, default=2 if fast_dev_run else 8, help='input batch size')
-    parser.add_argument('--workers', type=int, default=1 if fast_dev_run else 1, help='workers')
+    parser.add_argument('--workers', type=int, default=1 if fast_dev_run else None,
+                        help='dataloader workers per process, default: min(8, cpus per process)')
     parser.add_argument('--niter', type=int, default=10000 if not fast_dev_run else 3, help='number of epochs to train for')
 
     parser.add_argument('--nc', default=3)
@@ -1021,9 +1324,16 @@ def parse_args():
     parser.add_argument('--decay', type=float, default=0, help='weight decay for EBM')
     parser.add_argument('--grad_clip', type=float, default=None, help='weight decay for EBM')
     parser.add_argument('--lr_gamma', type=float, default=0.998, help='lr decay for EBM')
+    parser.add_argument('--accum_steps', type=int, default=1, help='batches of gradient accumulated per optimizer step')
     parser.add_argument('--use_scheduler', action='store_true', default=False, help='use scheduler')
 
     parser.add_argument('--model', default='', help="path to model (to continue training)")
+    parser.add_argument('--compile', action='store_true', default=False, help='torch.compile the denoiser and image encoder')
+    parser.add_argument('--bf16', action='store_true', default=False, help='bf16 autocast for the denoiser forward')
+    parser.add_argument('--fp16', action='store_true', default=False,
+                        help='fp16 autocast for the denoiser forward, with a GradScaler in training')
+    parser.add_argument('--activation_checkpoint', action='store_true', default=False,
+                        help='recompute the denoiser SA/FP block activations in backward to save memory')
 
 
     '''distributed'''